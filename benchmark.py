@@ -0,0 +1,253 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from json import dump as json_dump
+from json import load as json_load
+from os import makedirs
+from os.path import isfile
+from os.path import join as path_join
+from platform import platform, python_version
+from random import Random
+from re import compile as regex_compile
+from subprocess import DEVNULL, CalledProcessError, check_output
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from tracemalloc import get_traced_memory
+from tracemalloc import start as tracemalloc_start
+from tracemalloc import stop as tracemalloc_stop
+from typing import Any, Callable, Tuple
+
+from lib.config import PatcherConfig
+from lib.creation import create_patch_file
+from lib.diff import Direction
+from lib.patch import Patch, PatchFile
+from lib.patching import patch
+from lib.policy import Policy, PolicyRule
+from lib.ui.headless import HeadlessUserInterface
+from Typing import SCRIPT_ROOT
+
+RESULTS_FILENAME = 'benchmark.results.json'
+CONFIG_MOD_NAME = 'Config - Benchmark'
+
+
+def argparser() -> ArgumentParser:
+    argparser = ArgumentParser(
+        prog="Config Patcher for Stardew Valley - Benchmark",
+        description="Generates a synthetic Stardew Valley mod tree and measures applying and creating patches for it."
+    )
+
+    argparser.add_argument("--configs", type=int, default=200, help="Number of config.json files in the synthetic config mod.")
+    argparser.add_argument("--keys", type=int, default=50, help="Number of values in every config.json file.")
+    argparser.add_argument("--depth", type=int, default=3, help="Maximum nesting depth of the values in every config.json file.")
+    argparser.add_argument("--versions", type=int, default=20, help="Number of patch versions.")
+    argparser.add_argument("--patched-fraction", type=float, default=0.25, help="Fraction of config files that every patch version changes.")
+    argparser.add_argument("--jobs", type=int, default=1, help="Number of config files that are patched in parallel.")
+    argparser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per phase, the fastest run is reported.")
+    argparser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic mod tree, use the same seed to compare commits.")
+    argparser.add_argument("--output", type=str, default=path_join(SCRIPT_ROOT, RESULTS_FILENAME), help="JSON file the results are appended to.")
+
+    return argparser
+
+class _BenchmarkPatcherConfig(PatcherConfig):
+    # Keeps the patcher config and all caches inside the temporary benchmark folder
+    _data_folder: str = ''
+
+    @classmethod
+    def data_filepath(cls, filename: str) -> str:
+        return path_join(cls._data_folder, filename)
+
+#region Synthetic mod tree
+def _random_value_(rng: Random) -> Any:
+    match rng.randrange(4):
+        case 0:
+            return rng.randrange(1000)
+        case 1:
+            return rng.random() < 0.5
+        case 2:
+            return f'value_{rng.randrange(1000)}'
+        case _:
+            return [rng.randrange(100) for _ in range(rng.randrange(4))]
+
+def _random_config_(rng: Random, keys: int, depth: int) -> dict:
+    config: dict = {}
+
+    for key_idx in range(keys):
+        d = config
+        for level in range(rng.randrange(depth + 1)):
+            d = d.setdefault(f'Section{level}_{rng.randrange(3)}', {})
+        d[f'Key{key_idx}'] = _random_value_(rng)
+
+    return config
+
+def _random_patch_(rng: Random, config: dict) -> Patch:
+    # Changes and adds values of a random subset of the keys of the config
+    overwrite: dict = {}
+    create_on_missing: dict = {}
+
+    def walk(src: dict, overwrite_d: dict, create_d: dict, level: int) -> None:
+        for k, v in src.items():
+            if isinstance(v, dict):
+                walk(v, overwrite_d.setdefault(k, {}), create_d.setdefault(k, {}), level + 1)
+            elif rng.random() < 0.2:
+                overwrite_d[k] = _random_value_(rng)
+        if rng.random() < 0.2:
+            create_d[f'New{level}_{rng.randrange(1000)}'] = _random_value_(rng)
+
+    def prune(d: dict) -> dict:
+        pruned = {k: prune(v) if isinstance(v, dict) else v for k, v in d.items()}
+        return {k: v for k, v in pruned.items() if not isinstance(v, dict) or len(v) > 0}
+
+    walk(config, overwrite, create_on_missing, 0)
+    return Patch.from_dicts(create_on_missing=prune(create_on_missing), overwrite=prune(overwrite))
+
+def _rel_config_path_(idx: int) -> str:
+    return path_join('Mods', f'BenchmarkMod{idx}', 'config.json')
+
+def generate_tree(root: str, args) -> Tuple[_BenchmarkPatcherConfig, str]:
+    rng = Random(args.seed)
+
+    stardew_valley = path_join(root, 'Stardew Valley')
+    staging = path_join(root, 'staging')
+    config_mod_path = path_join(staging, CONFIG_MOD_NAME)
+    makedirs(stardew_valley)
+    makedirs(config_mod_path)
+
+    _BenchmarkPatcherConfig._data_folder = root
+    config = _BenchmarkPatcherConfig(
+        staging=staging,
+        stardew_valley=stardew_valley,
+        config_mod_regex=regex_compile(f'^{CONFIG_MOD_NAME}$'),
+        patch_version=-1,
+    )
+
+    configs = [_random_config_(rng, args.keys, args.depth) for _ in range(args.configs)]
+
+    for idx, cfg in enumerate(configs):
+        config_path = path_join(config_mod_path, _rel_config_path_(idx))
+        makedirs(path_join(config_mod_path, 'Mods', f'BenchmarkMod{idx}'))
+        with open(config_path, 'w') as f:
+            json_dump(cfg, f, indent=2)
+
+    for version in range(args.versions):
+        patched = rng.sample(range(args.configs), max(1, int(args.configs * args.patched_fraction)))
+        PatchFile.create_and_save(
+            version=version,
+            patches={_rel_config_path_(idx): _random_patch_(rng, configs[idx]) for idx in patched},
+            config=config,
+        )
+
+    return config, config_mod_path
+
+def _change_configs_(config_mod_path: str, args) -> None:
+    # Simulates the user changing settings in game, so creating a patch has differences to resolve
+    rng = Random(args.seed + 1)
+
+    for idx in rng.sample(range(args.configs), max(1, int(args.configs * args.patched_fraction))):
+        config_path = path_join(config_mod_path, _rel_config_path_(idx))
+        with open(config_path, 'r') as f:
+            cfg = json_load(f)
+        cfg.update(_random_config_(rng, max(1, args.keys // 10), args.depth))
+        with open(config_path, 'w') as f:
+            json_dump(cfg, f, indent=2)
+#endregion Synthetic mod tree
+
+def _measure_(args, run: Callable[[_BenchmarkPatcherConfig, str], None], prepare: Callable[[_BenchmarkPatcherConfig, str], None] | None = None) -> dict[str, Any]:
+    # Every run gets a freshly generated tree; the peak memory is measured in a separate run, as tracing slows it down.
+    def run_once(trace: bool) -> Tuple[float, int]:
+        with TemporaryDirectory() as root, redirect_stdout(StringIO()):
+            config, config_mod_path = generate_tree(root, args)
+            if prepare is not None:
+                prepare(config, config_mod_path)
+
+            if trace:
+                tracemalloc_start()
+            start = perf_counter()
+            run(config, config_mod_path)
+            wall_time = perf_counter() - start
+            peak_memory = 0
+            if trace:
+                _, peak_memory = get_traced_memory()
+                tracemalloc_stop()
+
+        return wall_time, peak_memory
+
+    wall_times = [run_once(trace=False)[0] for _ in range(max(1, args.repeat))]
+    _, peak_memory = run_once(trace=True)
+
+    return {
+        'wall_time_s': min(wall_times),
+        'wall_times_s': wall_times,
+        'peak_memory_bytes': peak_memory,
+        'files_per_second': args.configs / min(wall_times) if min(wall_times) > 0 else None,
+    }
+
+def _measure_startup_(args) -> dict[str, Any]:
+    # Time until the patcher is ready to work, i.e. starting the interpreter and importing config_patcher,
+    # which every run of the patcher pays before anything is patched
+    code = "import sys; import config_patcher; print('consolemenu' in sys.modules)"
+    wall_times: list[float] = []
+    imports_console_ui = False
+
+    for _ in range(max(1, args.repeat)):
+        start = perf_counter()
+        imports_console_ui = check_output([executable, '-c', code], cwd=SCRIPT_ROOT, text=True).strip() == 'True'
+        wall_times.append(perf_counter() - start)
+
+    return {
+        'wall_time_s': min(wall_times),
+        'wall_times_s': wall_times,
+        'imports_console_ui': imports_console_ui,
+    }
+
+def _git_commit_() -> str | None:
+    try:
+        return check_output(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_ROOT, stderr=DEVNULL, text=True).strip()
+    except (OSError, CalledProcessError):
+        return None
+
+def main():
+    args = argparser().parse_args()
+
+    def apply(config: _BenchmarkPatcherConfig, config_mod_path: str) -> None:
+        patch([config_mod_path], config, jobs=args.jobs)
+
+    def create(config: _BenchmarkPatcherConfig, config_mod_path: str) -> None:
+        # Resolves every difference to the value of the config file, like selecting CONFIG for every key in the compare menu
+        create_patch_file(config_mod_path, config, HeadlessUserInterface(Policy([PolicyRule(mod='*', key='*', direction=Direction.CONFIG)])))
+
+    def prepare_create(config: _BenchmarkPatcherConfig, config_mod_path: str) -> None:
+        patch([config_mod_path], config, jobs=args.jobs)
+        _change_configs_(config_mod_path, args)
+
+    print(f'Benchmarking {args.configs} config files with {args.keys} keys and {args.versions} patch versions...')
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit_(),
+        'python': python_version(),
+        'platform': platform(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+        'startup': _measure_startup_(args),
+        'phases': {
+            'apply': _measure_(args, apply),
+            'create': _measure_(args, create, prepare=prepare_create),
+        },
+    }
+
+    print(f'startup: {results["startup"]["wall_time_s"]:.3f} s{", imports the console UI" if results["startup"]["imports_console_ui"] else ""}')
+    for phase, result in results['phases'].items():
+        print(f'{phase}: {result["wall_time_s"]:.3f} s, {result["peak_memory_bytes"] / 2**20:.1f} MiB peak, {result["files_per_second"]:.0f} files/s')
+
+    all_results: list = []
+    if isfile(args.output):
+        with open(args.output, 'r') as f:
+            all_results = json_load(f)
+    all_results.append(results)
+
+    with open(args.output, 'w') as f:
+        json_dump(all_results, f, indent=2)
+    print(f'Results appended to: {args.output}')
+
+if __name__ == "__main__":
+    main()
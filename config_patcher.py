@@ -1,13 +1,28 @@
 from argparse import ArgumentParser
-from os import listdir
+from cProfile import Profile
+from functools import cache
 from os.path import isdir, isfile
 from os.path import join as path_join
+from typing import TYPE_CHECKING
 
+from lib.backup import BackupStore
+from lib.compaction import compact_patches
 from lib.config import PatcherConfig
 from lib.creation import create_patch_file
+from lib.discovery import DiscoveryCache, scan_for_config_mods
+from lib.errors import PatcherError
+from lib.pathfilter import PathFilter
+from lib.patch import convert_patch_files
 from lib.patching import patch
+from lib.policy import Policy
+from lib.profiling import profiler
+from lib.transaction import ApplyTransaction
+from lib.watch import watch_config_mod
 
-from lib.ui.console import ConsoleUserInterface
+from lib.ui.headless import HeadlessUserInterface
+
+if TYPE_CHECKING:
+    from lib.ui.console import ConsoleUserInterface
 
 
 def argparser() -> ArgumentParser:
@@ -17,46 +32,172 @@ def argparser() -> ArgumentParser:
     )
 
     argparser.add_argument("--create", action='store_true', default=False, help="Changes the mode to create a new patch file from all provided config files and existing patches.")
+    argparser.add_argument("--policy", type=str, default=None, metavar='FILE', help="Resolves all differences with the rules of the policy FILE instead of the compare menu when creating a patch file.")
+    argparser.add_argument("--watch", action='store_true', default=False, help="Watches the selected config mod for changed config files and creates a patch file from the pending changes on command.")
     argparser.add_argument("--close", action='store_true', default=False, help="Closes the script immediately after completion without waiting for user input.")
+    argparser.add_argument("--convert-patches", action='store_true', default=False, help="Converts all patch files in the Patches folder to the current patch file format.")
+    argparser.add_argument("--compact", type=int, default=None, metavar='UPTO', help="Folds all patch versions up to and including UPTO into a single baseline patch file.")
+    argparser.add_argument("--restore", type=str, default=None, metavar='TIMESTAMP', help="Restores the selected config mod from the backup with the given timestamp instead of patching it.")
+    argparser.add_argument("--target", type=str, default=None, metavar='FOLDER', help="Uses the config mod FOLDER (a path or a folder name in the staging folder) instead of selecting one in a menu.")
+    argparser.add_argument("--restore-file", type=str, default=None, metavar='PATH', help="Restores only the config file PATH relative to the selected config mod from the latest backup instead of patching it.")
+    argparser.add_argument("--at", type=str, default=None, metavar='TIME', help="Only together with --restore-file. Restores the file from the latest backup taken at or before TIME, e.g. 2024-08-01T18-30.")
+    argparser.add_argument("--only", type=str, action='append', default=None, metavar='GLOB', help="Only applies, creates or watches patches for config files whose path relative to the config mod matches GLOB. Can be repeated.")
+    argparser.add_argument("--exclude", type=str, action='append', default=None, metavar='GLOB', help="Skips config files whose path relative to the config mod matches GLOB. Can be repeated.")
+    argparser.add_argument("--all", action='store_true', default=False, help="Applies the patches to every config mod matching the config mod regex at the same time instead of selecting one.")
+    argparser.add_argument("--jobs", type=int, default=1, metavar='N', help="Number of config files that are patched in parallel. Patches are applied serially if N is 1.")
+    argparser.add_argument("--profile", action='store_true', default=False, help="Times every phase, version and config file, prints the slowest ones and writes a JSON report next to the patcher config.")
+    argparser.add_argument("--cprofile", type=str, default=None, metavar='FILE', help="Writes a cProfile dump of the whole run to FILE, e.g. for snakeviz or pstats.")
 
     return argparser
 
-def get_output_dir(patcher_config: PatcherConfig, cui: ConsoleUserInterface) -> str:
-    config_folders = [
-        path_join(patcher_config.staging, folder)
-        for folder
-        in listdir(patcher_config.staging)
-        if (
-            patcher_config.config_mod_regex.match(folder)
-            and isdir(path_join(patcher_config.staging, folder))
-        )
-    ]
-
-    return cui.output_folder(config_folders)
-
-def create_PatcherConfig(cui: ConsoleUserInterface) -> PatcherConfig:
-    pc = cui.create_PatcherConfig()
+def get_config_mod_dirs(patcher_config: PatcherConfig) -> list[str]:
+    with profiler.section('get_output_dir scan'):
+        discovery_cache = DiscoveryCache.load(patcher_config)
+        config_folders = scan_for_config_mods(patcher_config.staging, patcher_config.config_mod_regex, discovery_cache)
+        discovery_cache.save()
+
+    return config_folders
+
+@cache
+def console_user_interface() -> 'ConsoleUserInterface':
+    # Imports consolemenu and creates the menus only once a menu is shown
+    from lib.ui.console import ConsoleUserInterface
+    return ConsoleUserInterface()
+
+def get_output_dir(patcher_config: PatcherConfig, target: str | None = None) -> str:
+    if target is None:
+        return console_user_interface().output_folder(get_config_mod_dirs(patcher_config))
+
+    config_mod_path = target if isdir(target) else path_join(patcher_config.staging, target)
+    if not isdir(config_mod_path):
+        argparser().error(f'--target {target} is neither a folder nor a folder in {patcher_config.staging}')
+    return config_mod_path
+
+def create_PatcherConfig() -> PatcherConfig:
+    pc = console_user_interface().create_PatcherConfig()
     pc.save()
     return pc
 
+PROFILE_REPORT_FILENAME = 'config_patcher.profile.json'
+UNRESOLVED_REPORT_FILENAME = 'config_patcher.unresolved.json'
+
 def main():
     args = argparser().parse_args()
 
-    cui = ConsoleUserInterface()
+    if args.policy is not None and not (args.create or args.watch):
+        argparser().error('--policy can only be used together with --create or --watch')
+
+    if args.watch and (args.create or args.restore is not None):
+        argparser().error('--watch can not be used together with --create or --restore')
+
+    if args.at is not None and args.restore_file is None:
+        argparser().error('--at can only be used together with --restore-file')
+
+    if args.restore_file is not None and (args.create or args.watch or args.all or args.restore is not None):
+        argparser().error('--restore-file can not be used together with --create, --watch, --all or --restore')
+
+    if args.all and (args.create or args.watch or args.restore is not None):
+        argparser().error('--all can not be used together with --create, --watch or --restore')
+
+    if args.target is not None and args.all:
+        argparser().error('--target can not be used together with --all')
+
+    if (args.only is not None or args.exclude is not None) and (args.restore is not None or args.restore_file is not None or args.compact is not None or args.convert_patches):
+        argparser().error('--only and --exclude can not be used together with --restore, --restore-file, --compact or --convert-patches')
+
+    if args.profile:
+        profiler.enable()
+
+    if args.cprofile is not None:
+        cprofile = Profile()
+        cprofile.enable()
+
+    exit_code = 0
+    try:
+        run(args)
+    except PatcherError as e:
+        print(f'[!] {e}')
+        exit_code = 1
+    finally:
+        # Also report failed runs, as they are the ones that need to be investigated
+        if args.cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+            print(f'cProfile dump written to: {args.cprofile}')
+
+        if args.profile:
+            profiler.print_report()
+            report_filepath = PatcherConfig.data_filepath(PROFILE_REPORT_FILENAME)
+            profiler.save_report(report_filepath)
+            print(f'Profile report written to: {report_filepath}')
+
+    if not args.close:
+        _ = input("Press enter to close...")
+
+    if exit_code != 0:
+        raise SystemExit(exit_code)
+
+def run(args):
     config_filepath = PatcherConfig.filepath()
-    patcher_config = PatcherConfig.from_file() if isfile(config_filepath) else create_PatcherConfig(cui)
+    with profiler.section('config load'):
+        patcher_config = PatcherConfig.from_file() if isfile(config_filepath) else None
+    if patcher_config is None:
+        patcher_config = create_PatcherConfig()
+
+    # Completes or reverts patching that was interrupted in the last run
+    ApplyTransaction.recover(patcher_config)
+
+    path_filter = PathFilter(args.only, args.exclude) if args.only is not None or args.exclude is not None else None
 
-    config_mod_path = get_output_dir(patcher_config, cui)
+    if args.convert_patches:
+        converted = convert_patch_files(patcher_config)
+        print(f'Converted {len(converted)} patch files: {", ".join(converted) or "none"}')
+        return
+
+    if args.compact is not None:
+        compact_patches(patcher_config, args.compact)
+        return
+
+    if args.all:
+        config_mod_paths = get_config_mod_dirs(patcher_config)
+        if len(config_mod_paths) < 1:
+            print(f'[!] No config mod in {patcher_config.staging} matches {patcher_config.config_mod_regex.pattern}')
+            return
+
+        print(f'> Patching {len(config_mod_paths)} config mods: {", ".join(patcher_config.target_name(path) for path in config_mod_paths)}')
+        patch(config_mod_paths, patcher_config, jobs=args.jobs, path_filter=path_filter)
+        patcher_config.save()
+        return
+
+    config_mod_path = get_output_dir(patcher_config, args.target)
     
-    if args.create:
-        create_patch_file(config_mod_path, patcher_config, cui)
+    if args.restore_file is not None:
+        timestamp = BackupStore(config_mod_path, patcher_config).restore_file(args.restore_file, args.at)
+        print(f'{args.restore_file} restored successfully from backup {timestamp}')
+    elif args.restore is not None:
+        manifest = BackupStore(config_mod_path, patcher_config).restore(args.restore)
+        patcher_config.set_target_version(config_mod_path, manifest.patch_version)
+        print(f'Backup {manifest.timestamp} restored successfully to: {config_mod_path}')
+    elif (args.create or args.watch) and args.policy is not None:
+        hui = HeadlessUserInterface(Policy.from_file(args.policy))
+        if args.watch:
+            watch_config_mod(config_mod_path, patcher_config, hui, path_filter)
+        else:
+            with profiler.section('create'):
+                create_patch_file(config_mod_path, patcher_config, hui, path_filter)
+        hui.print_report()
+        report_filepath = PatcherConfig.data_filepath(UNRESOLVED_REPORT_FILENAME)
+        hui.save_report(report_filepath)
+        print(f'Report of unresolved differences written to: {report_filepath}')
+    elif args.watch:
+        watch_config_mod(config_mod_path, patcher_config, console_user_interface(), path_filter)
+    elif args.create:
+        with profiler.section('create'):
+            create_patch_file(config_mod_path, patcher_config, console_user_interface(), path_filter)
     else:
-        patch(config_mod_path, patcher_config)
+        patch([config_mod_path], patcher_config, jobs=args.jobs, path_filter=path_filter)
     
     patcher_config.save()
 
-    if not args.close:
-        _ = input("Press enter to close...")
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,395 @@
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import sha256
+from json import dump as json_dump
+from json import load as json_load
+from os import listdir, makedirs, pardir, remove, replace, sep, stat, utime, walk
+from os.path import abspath, basename, dirname, isabs, isdir, isfile, normpath
+from os.path import join as path_join
+from os.path import relpath
+from re import compile as regex_compile
+from re import escape as regex_escape
+from shutil import move
+from typing import Any
+from zipfile import ZipFile
+
+from lib.config import PatcherConfig
+from lib.errors import PatcherError
+from lib.policy import normalize_rel_path
+
+
+@dataclass
+class BackupEntry():
+    hash: str
+    size: int
+    mtime_ns: int
+
+    def __json__(self) -> list:
+        return [self.hash, self.size, self.mtime_ns]
+
+@dataclass
+class BackupManifest():
+    timestamp: str
+    patch_version: int
+    files: dict[str, BackupEntry]
+
+    def __json__(self) -> dict[str, Any]:
+        return {
+            'timestamp': self.timestamp,
+            'patch_version': self.patch_version,
+            'files': {k: e.__json__() for k, e in self.files.items()},
+        }
+
+    @classmethod
+    def from_json(cls, json: dict[str, Any]) -> 'BackupManifest':
+        return cls(
+            timestamp=json['timestamp'],
+            patch_version=json['patch_version'],
+            files={k: BackupEntry(*v) for k, v in json['files'].items()},
+        )
+
+@dataclass
+class CatalogBackup():
+    # A backup is either a manifest of the content addressed store, or a zip archive of the whole config mod,
+    # which older versions of the patcher created next to the config mod.
+    MANIFEST = 'manifest'
+    ARCHIVE = 'archive'
+
+    kind: str
+    filepath: str
+    size: int
+    mtime_ns: int
+
+    def __json__(self) -> list:
+        return [self.kind, self.filepath, self.size, self.mtime_ns]
+
+@dataclass
+class BackupCatalog():
+    # Index of all backups of a config mod, so a single file can be restored without reading every manifest or archive.
+    #   backups: timestamp -> manifest or archive
+    #   files:   relative path (with forward slashes) -> timestamp -> [object hash or archive member name, mtime_ns]
+    # Backups whose size and mtime did not change are not read again.
+    backups: dict[str, CatalogBackup]
+    files: dict[str, dict[str, list]]
+
+    @dataclass
+    class Keys():
+        BACKUPS = "backups"
+        FILES = "files"
+
+    def __json__(self) -> dict[str, Any]:
+        return {
+            self.Keys.BACKUPS: {k: b.__json__() for k, b in self.backups.items()},
+            self.Keys.FILES: self.files,
+        }
+
+    @classmethod
+    def from_json(cls, json: dict[str, Any]) -> 'BackupCatalog':
+        return cls(
+            backups={k: CatalogBackup(*v) for k, v in json[cls.Keys.BACKUPS].items()},
+            files=json[cls.Keys.FILES],
+        )
+
+    def timestamps(self) -> list[str]:
+        return sorted(self.backups)
+
+    def remove_backup(self, timestamp: str) -> None:
+        self.backups.pop(timestamp, None)
+        for locations in self.files.values():
+            locations.pop(timestamp, None)
+        self.files = {k: v for k, v in self.files.items() if len(v) > 0}
+
+    def add_backup(self, timestamp: str, backup: CatalogBackup, locations: dict[str, list]) -> None:
+        self.remove_backup(timestamp)
+        self.backups[timestamp] = backup
+        for rel_path, location in locations.items():
+            self.files.setdefault(normalize_rel_path(rel_path), {})[timestamp] = location
+
+class BackupStore():
+    # Content addressed backup store in config_patcher.backups/<config mod> next to the patcher config:
+    #   objects/<hash[:2]>/<hash>   file contents, each stored exactly once
+    #   manifests/<timestamp>.json  relative path -> (hash, size, mtime) of every file at backup time
+    FOLDER_NAME = 'config_patcher.backups'
+    # Older versions kept the store in <config mod>_backups next to the config mod, i.e. inside the staging folder
+    LEGACY_FOLDER_SUFFIX = '_backups'
+    OBJECTS_FOLDER_NAME = 'objects'
+    MANIFESTS_FOLDER_NAME = 'manifests'
+    MANIFEST_EXTENSION = '.json'
+    CATALOG_FILENAME = 'catalog.json'
+    TIMESTAMP_FORMAT = '%Y-%m-%dT%H-%M-%S'
+    # Zip archives of older versions: <config mod>_<%Y-%m-%dT%H-%M>.zip next to the config mod
+    ARCHIVE_PATTERN = r'^{name}_(\d{{4}}-\d{{2}}-\d{{2}}T\d{{2}}-\d{{2}})\.zip$'
+    # A timestamp that may be shortened, e.g. 2024-08-01T18
+    AT_REGEX = regex_compile(r'^\d{4}(-\d{2}(-\d{2}(T\d{2}(-\d{2}(-\d{2})?)?)?)?)?$')
+
+    config_mod_path: str
+    folder: str
+
+    def __init__(self, config_mod_path: str, config: PatcherConfig) -> None:
+        self.config_mod_path = abspath(config_mod_path)
+        self.folder = path_join(config.data_filepath(self.FOLDER_NAME), config.target_name(self.config_mod_path))
+        self._migrate_()
+
+    @classmethod
+    def is_legacy_folder(cls, folder: str) -> bool:
+        return folder.endswith(cls.LEGACY_FOLDER_SUFFIX)
+
+    def _migrate_(self) -> None:
+        legacy_folder = f'{self.config_mod_path}{self.LEGACY_FOLDER_SUFFIX}'
+        if not isdir(legacy_folder) or isdir(self.folder):
+            return
+
+        makedirs(dirname(self.folder), exist_ok=True)
+        move(legacy_folder, self.folder)
+        # The catalog contains the paths of the manifests
+        if isfile(self.catalog_filepath):
+            remove(self.catalog_filepath)
+        print(f'[!] Moved the backups of {basename(self.config_mod_path)} out of the staging folder to: {self.folder}')
+
+    @property
+    def objects_folder(self) -> str:
+        return path_join(self.folder, self.OBJECTS_FOLDER_NAME)
+
+    @property
+    def manifests_folder(self) -> str:
+        return path_join(self.folder, self.MANIFESTS_FOLDER_NAME)
+
+    def _object_path_(self, hash: str) -> str:
+        return path_join(self.objects_folder, hash[:2], hash)
+
+    def _manifest_path_(self, timestamp: str) -> str:
+        return path_join(self.manifests_folder, f'{timestamp}{self.MANIFEST_EXTENSION}')
+
+    @property
+    def catalog_filepath(self) -> str:
+        return path_join(self.folder, self.CATALOG_FILENAME)
+
+    def snapshots(self) -> list[str]:
+        if not isdir(self.manifests_folder):
+            return []
+
+        return sorted(
+            item.removesuffix(self.MANIFEST_EXTENSION)
+            for item
+            in listdir(self.manifests_folder)
+            if item.endswith(self.MANIFEST_EXTENSION)
+        )
+
+    def load_manifest(self, timestamp: str) -> BackupManifest:
+        manifest_path = self._manifest_path_(timestamp)
+        if not isfile(manifest_path):
+            raise PatcherError(f'Backup {timestamp} does not exist, available backups: {", ".join(self.snapshots()) or "none"}')
+
+        with open(manifest_path, 'r') as f:
+            return BackupManifest.from_json(json_load(f))
+
+    def _store_object_(self, filepath: str) -> str:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+
+        hash = sha256(content).hexdigest()
+        object_path = self._object_path_(hash)
+
+        if not isfile(object_path):
+            makedirs(dirname(object_path), exist_ok=True)
+            temp_path = f'{object_path}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+            replace(temp_path, object_path)
+
+        return hash
+
+    def backup(self, patch_version: int) -> str | None:
+        if not isdir(self.config_mod_path):
+            return None
+
+        # Unchanged files (same size and mtime as in the latest backup) are neither read nor hashed again.
+        snapshots = self.snapshots()
+        previous_files = self.load_manifest(snapshots[-1]).files if len(snapshots) > 0 else {}
+
+        files: dict[str, BackupEntry] = {}
+
+        for root, _, filenames in walk(self.config_mod_path):
+            for filename in filenames:
+                filepath = path_join(root, filename)
+                rel_path = relpath(filepath, self.config_mod_path)
+                st = stat(filepath)
+
+                previous = previous_files.get(rel_path)
+                if previous is not None and previous.size == st.st_size and previous.mtime_ns == st.st_mtime_ns:
+                    files[rel_path] = previous
+                else:
+                    files[rel_path] = BackupEntry(self._store_object_(filepath), st.st_size, st.st_mtime_ns)
+
+        timestamp = datetime.now().strftime(self.TIMESTAMP_FORMAT)
+        # Unused and sorted after the backups of the same second, even if some of them were pruned
+        same_second = [snapshot for snapshot in snapshots if snapshot.split('_')[0] == timestamp]
+        candidate, suffix = timestamp, 1
+        while isfile(self._manifest_path_(candidate)) or any(snapshot >= candidate for snapshot in same_second):
+            candidate = f'{timestamp}_{suffix}'
+            suffix += 1
+        timestamp = candidate
+
+        makedirs(self.manifests_folder, exist_ok=True)
+        with open(self._manifest_path_(timestamp), 'w') as f:
+            json_dump(BackupManifest(timestamp, patch_version, files).__json__(), f, indent=None)
+
+        return timestamp
+
+    def restore(self, timestamp: str) -> BackupManifest:
+        manifest = self.load_manifest(timestamp)
+
+        if isdir(self.config_mod_path):
+            for root, _, filenames in walk(self.config_mod_path):
+                for filename in filenames:
+                    filepath = path_join(root, filename)
+                    if relpath(filepath, self.config_mod_path) not in manifest.files:
+                        remove(filepath)
+
+        for rel_path, entry in manifest.files.items():
+            filepath = path_join(self.config_mod_path, rel_path)
+
+            with open(self._object_path_(entry.hash), 'rb') as f:
+                content = f.read()
+
+            makedirs(dirname(filepath), exist_ok=True)
+            with open(filepath, 'wb') as f:
+                f.write(content)
+            # Keep the recorded mtime, so the next backup recognizes the file as unchanged.
+            utime(filepath, ns=(entry.mtime_ns, entry.mtime_ns))
+
+        return manifest
+
+    #region Catalog
+    def archives(self) -> dict[str, str]:
+        # Timestamp of every zip archive of older versions -> its path. The seconds are missing in their names.
+        folder = dirname(self.config_mod_path)
+        regex = regex_compile(self.ARCHIVE_PATTERN.format(name=regex_escape(basename(self.config_mod_path))))
+
+        return {
+            f'{match.group(1)}-00': path_join(folder, item)
+            for item
+            in listdir(folder)
+            if (match := regex.match(item)) is not None
+        }
+
+    def _load_catalog_(self) -> BackupCatalog:
+        if isfile(self.catalog_filepath):
+            try:
+                with open(self.catalog_filepath, 'r') as f:
+                    return BackupCatalog.from_json(json_load(f))
+            except Exception as e:
+                print(f"[!] Ignoring invalid backup catalog {self.catalog_filepath}: {e}")
+
+        return BackupCatalog(backups={}, files={})
+
+    def catalog(self) -> BackupCatalog:
+        catalog = self._load_catalog_()
+        changed = False
+
+        backups = {timestamp: (CatalogBackup.MANIFEST, self._manifest_path_(timestamp)) for timestamp in self.snapshots()}
+        for timestamp, filepath in self.archives().items():
+            backups.setdefault(timestamp, (CatalogBackup.ARCHIVE, filepath))
+
+        for timestamp in [timestamp for timestamp in catalog.backups if timestamp not in backups]:
+            catalog.remove_backup(timestamp)
+            changed = True
+
+        for timestamp, (kind, filepath) in backups.items():
+            st = stat(filepath)
+            cached = catalog.backups.get(timestamp)
+            if cached is not None and cached.filepath == filepath and cached.size == st.st_size and cached.mtime_ns == st.st_mtime_ns:
+                continue
+
+            if kind == CatalogBackup.MANIFEST:
+                locations = {rel_path: [entry.hash, entry.mtime_ns] for rel_path, entry in self.load_manifest(timestamp).files.items()}
+            else:
+                with ZipFile(filepath, 'r') as archive:
+                    locations = {
+                        info.filename: [info.filename, int(datetime(*info.date_time).timestamp() * 1e9)]
+                        for info
+                        in archive.infolist()
+                        if not info.is_dir()
+                    }
+
+            catalog.add_backup(timestamp, CatalogBackup(kind, filepath, st.st_size, st.st_mtime_ns), locations)
+            changed = True
+
+        if changed:
+            makedirs(self.folder, exist_ok=True)
+            temp_path = f'{self.catalog_filepath}.tmp'
+            with open(temp_path, 'w') as f:
+                json_dump(catalog.__json__(), f, indent=None)
+            replace(temp_path, self.catalog_filepath)
+
+        return catalog
+
+    def restore_file(self, rel_path: str, at: str | None = None) -> str:
+        # Restores a single file from the latest backup taken at or before at, which can be shortened (e.g. 2024-08-01T18).
+        # Only this file is read from the backup. Returns the timestamp of the backup.
+        if at is not None and not self.AT_REGEX.match(at):
+            raise PatcherError(f'{at} is not a timestamp like 2024-08-01T18-30-00, which can be shortened to e.g. 2024-08-01T18.')
+        if isabs(rel_path) or normpath(rel_path).split(sep)[0] == pardir:
+            raise PatcherError(f'{rel_path} is not a path relative to the config mod {basename(self.config_mod_path)}.')
+
+        catalog = self.catalog()
+        rel_path = normalize_rel_path(rel_path)
+
+        timestamps = [timestamp for timestamp in catalog.timestamps() if at is None or timestamp[:len(at)] <= at]
+        if len(timestamps) < 1:
+            raise PatcherError(f'No backup of {basename(self.config_mod_path)} was taken {f"at or before {at}" if at is not None else "yet"}.')
+        timestamp = timestamps[-1]
+
+        location = catalog.files.get(rel_path, {}).get(timestamp)
+        if location is None:
+            older = [t for t in catalog.files.get(rel_path, {}) if t < timestamp]
+            raise PatcherError(f'{rel_path} is not contained in backup {timestamp}{f", the latest backup containing it is {max(older)}" if len(older) > 0 else ""}.')
+
+        backup = catalog.backups[timestamp]
+        member, mtime_ns = location
+        if backup.kind == CatalogBackup.MANIFEST:
+            with open(self._object_path_(member), 'rb') as f:
+                content = f.read()
+        else:
+            with ZipFile(backup.filepath, 'r') as archive:
+                content = archive.read(member)
+
+        filepath = path_join(self.config_mod_path, rel_path)
+        makedirs(dirname(filepath), exist_ok=True)
+        temp_path = f'{filepath}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        replace(temp_path, filepath)
+        utime(filepath, ns=(mtime_ns, mtime_ns))
+
+        return timestamp
+
+    def prune(self, keep: int) -> list[str]:
+        # Deletes all but the latest keep backups, including zip archives of older versions,
+        # and the stored file contents only referenced by deleted backups. Returns the timestamps of the deleted backups.
+        catalog = self.catalog()
+        timestamps = catalog.timestamps()
+        if keep < 1 or len(timestamps) <= keep:
+            return []
+
+        pruned = timestamps[:-keep]
+        for timestamp in pruned:
+            remove(catalog.backups[timestamp].filepath)
+
+        # Every hash still referenced by a remaining manifest
+        catalog = self.catalog()
+        referenced = {
+            location[0]
+            for locations in catalog.files.values()
+            for timestamp, location in locations.items()
+            if catalog.backups[timestamp].kind == CatalogBackup.MANIFEST
+        }
+
+        if isdir(self.objects_folder):
+            for root, _, filenames in walk(self.objects_folder):
+                for filename in filenames:
+                    if filename not in referenced:
+                        remove(path_join(root, filename))
+
+        return pruned
+    #endregion Catalog
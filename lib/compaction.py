@@ -0,0 +1,98 @@
+from copy import deepcopy
+from json import dumps as json_dumps
+from os import makedirs, replace
+from os.path import isdir, isfile
+from os.path import join as path_join
+from shutil import copy2
+
+from lib.config import PatcherConfig
+from lib.errors import PatcherError
+from lib.discovery import DiscoveryCache, scan_for_config_mods
+from lib.jsonc import read_jsonc
+from lib.operations import fold_operations
+from lib.patch import PATCH_FOLDER, BaselinePatch, ComposedPatch, PatchFile, PatchIndex, compose_patches, load_patches
+
+COMPACTED_FOLDER_NAME = 'compacted'
+
+def _get_config_mod_paths_(config: PatcherConfig) -> list[str]:
+    discovery_cache = DiscoveryCache.load(config)
+    config_mod_paths = scan_for_config_mods(config.staging, config.config_mod_regex, discovery_cache)
+    discovery_cache.save()
+    return config_mod_paths
+
+def _verify_(config_mod_paths: list[str], composed_patches: dict[str, ComposedPatch], baseline_patches: dict[str, BaselinePatch]) -> None:
+    # Applies the original and the compacted chain to an empty config and to the current config file of every config mod
+    for rel_config_path, composed_patch in composed_patches.items():
+        configs = [None] + [
+            read_jsonc(config_path)
+            for config_path
+            in (path_join(config_mod_path, rel_config_path) for config_mod_path in config_mod_paths)
+            if isfile(config_path)
+        ]
+
+        for cfg in configs:
+            try:
+                expected = json_dumps(composed_patch._apply_(deepcopy(cfg)))
+            except AssertionError: # Invalid Config, which the original chain can not be applied to either
+                continue
+
+            if json_dumps(baseline_patches[rel_config_path]._apply_(deepcopy(cfg))) != expected:
+                raise PatcherError(f'Compacting would change the patched config of {rel_config_path}, no patch file was changed.')
+
+def compact_patches(config: PatcherConfig, upto: int) -> str:
+    # Folds all versions up to and including upto into a baseline patch file with the version upto.
+    # The folded patch files are moved to Patches/compacted/v{first}-v{upto}.
+    patch_index = PatchIndex.load(config)
+    versions = patch_index.pending_versions(-1)
+
+    if upto not in versions:
+        raise PatcherError(f'Version {upto} does not exist, the patch versions are {versions[0]} to {versions[-1]}.' if len(versions) > 0 else 'There are no patch files.')
+    if upto == versions[0]:
+        raise PatcherError(f'Version {upto} is the first version, there is nothing to compact.')
+
+    baseline = patch_index.baseline()
+    first_version = baseline.baseline if baseline is not None else versions[0]
+    assert first_version is not None
+
+    # Config mods within the compacted versions could not be patched anymore, as their next version is part of the baseline.
+    # Only existing config mods are checked, versions of deleted ones are still tracked but never used again.
+    config_mod_paths = _get_config_mod_paths_(config)
+    for config_mod_path in config_mod_paths:
+        version = config.target_version(config_mod_path)
+        if first_version <= version < upto:
+            raise PatcherError(f'{config.target_name(config_mod_path)} is at version {version}, which would be compacted. Patch it to version {upto} or later first.')
+
+    folded_versions = [version for version in versions if version <= upto]
+    patchfiles = load_patches(config, versions=folded_versions, index=patch_index)
+    composed_patches = compose_patches(patchfiles, folded_versions)
+
+    baseline_patches = {
+        rel_config_path: BaselinePatch(fold_operations(composed_patch.operations), before=composed_patch.before, after=composed_patch.after)
+        for rel_config_path, composed_patch
+        in composed_patches.items()
+    }
+    _verify_(config_mod_paths, composed_patches, baseline_patches)
+
+    patch_folder = PATCH_FOLDER(config)
+    archive_folder = path_join(patch_folder, COMPACTED_FOLDER_NAME, f'v{first_version}-v{upto}')
+    if isdir(archive_folder):
+        raise PatcherError(f'{archive_folder} already exists.')
+    makedirs(archive_folder)
+
+    baseline_filename = patch_index.filename(upto)
+    for version in folded_versions:
+        filename = patch_index.filename(version)
+        if filename == baseline_filename:
+            # Atomically replaced by the baseline below
+            copy2(path_join(patch_folder, filename), path_join(archive_folder, filename))
+        else:
+            replace(path_join(patch_folder, filename), path_join(archive_folder, filename))
+
+    PatchFile.save_baseline(baseline_filename, baseline_patches, baseline=first_version, config=config)
+
+    operation_count = sum(len(composed_patch.operations) for composed_patch in composed_patches.values())
+    baseline_operation_count = sum(len(baseline_patch.operations) for baseline_patch in baseline_patches.values())
+    print(f'> Compacted versions {first_version} to {upto} ({operation_count} operations) into the baseline {baseline_filename} ({baseline_operation_count} operations).')
+    print(f'> The compacted patch files were moved to: {archive_folder}')
+
+    return baseline_filename
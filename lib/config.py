@@ -1,27 +1,17 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import cached_property
-from json import loads as load_json_string
+from json import dumps as json_dumps
+from os.path import basename, normpath
 from os.path import join as path_join
-from re import DOTALL as regex_DOTALL
 from re import Pattern
 from re import compile as regex_compile
-from re import sub as regex_sub
+from threading import Lock
 
+from lib.jsonc import read_jsonc
 from Typing import SCRIPT_ROOT
 
-
-def read_jsonc(filepath: str):
-    # read jsonc file
-    with open(filepath, 'r') as f:
-        jsonc_str = f.read()
-
-    # Remove single-line comments (//)
-    jsonc_str = regex_sub(r'//.*', '', jsonc_str)
-    # Remove multi-line comments (/* */)
-    jsonc_str = regex_sub(r'/\*.*?\*/', '', jsonc_str, flags=regex_DOTALL)
-
-    # read json
-    return load_json_string(jsonc_str)
+# Several config mods can be patched at the same time, which all update and save the same config
+_LOCK = Lock()
 
 @dataclass
 class PatcherConfig():
@@ -29,6 +19,11 @@ class PatcherConfig():
     stardew_valley: str
     config_mod_regex: Pattern
     patch_version: int
+    # Patch version of every config mod folder by its name. Folders without an own version use patch_version,
+    # which is only set by older versions until the next patch migrates it.
+    target_versions: dict[str, int] = field(default_factory=dict)
+    # Number of backups kept of every config mod, 0 keeps all of them
+    keep_backups: int = 0
 
     FILENAME = 'config_patcher.config.jsonc'
 
@@ -39,9 +34,14 @@ class PatcherConfig():
     "staging": "{staging}",
     // Regex pattern to match for config mods in the staging folder
     "config_mod_regex": "{config_mod_regex}",
+    // Number of backups kept of every config mod, older backups are deleted after patching. 0 keeps all backups
+    "keep_backups": {keep_backups},
     // DO NOT EDIT THIS VALUE
     // AS THIS TRACKS THE CURRENT PATCH VERSION
-    "patch_version": {patch_version}
+    "patch_version": {patch_version},
+    // DO NOT EDIT THIS VALUE
+    // AS THIS TRACKS THE CURRENT PATCH VERSION OF EVERY CONFIG MOD FOLDER
+    "target_versions": {target_versions}
 }'''
 
     @dataclass
@@ -49,11 +49,17 @@ class PatcherConfig():
         STAGING = "staging"
         STARDEW_VALLEY = "stardew_valley"
         CONFIG_MOD_REGEX = "config_mod_regex"
+        KEEP_BACKUPS = "keep_backups"
         PATCH_VERSION = "patch_version"
+        TARGET_VERSIONS = "target_versions"
     
+    @classmethod
+    def data_filepath(cls, filename: str) -> str:
+        return path_join(SCRIPT_ROOT, filename)
+
     @classmethod
     def filepath(cls) -> str:
-        return path_join(SCRIPT_ROOT, cls.FILENAME)
+        return cls.data_filepath(cls.FILENAME)
     
     @cached_property
     def mods(self) -> str:
@@ -79,12 +85,20 @@ class PatcherConfig():
         stardew_valley = get_str(cls.Keys.STARDEW_VALLEY)
         config_mod_regex = get_str(cls.Keys.CONFIG_MOD_REGEX)
         patch_version = get_int(cls.Keys.PATCH_VERSION)
+        # Not contained in config files written before multiple config mods could be patched
+        target_versions = data.get(cls.Keys.TARGET_VERSIONS, {})
+        assert isinstance(target_versions, dict)
+        # Not contained in config files written before backups were pruned
+        keep_backups = data.get(cls.Keys.KEEP_BACKUPS, 0)
+        assert isinstance(keep_backups, int)
 
         return cls(
             staging=staging,
             stardew_valley=stardew_valley,
             config_mod_regex=regex_compile(config_mod_regex),
             patch_version=patch_version,
+            target_versions=target_versions,
+            keep_backups=keep_backups,
         )
     
     def set_version(self, version: int):
@@ -93,19 +107,43 @@ class PatcherConfig():
     def increment_version(self):
         self.set_version(self.patch_version + 1)
 
+    @staticmethod
+    def target_name(config_mod_path: str) -> str:
+        return basename(normpath(config_mod_path))
+
+    def target_version(self, config_mod_path: str) -> int:
+        return self.target_versions.get(self.target_name(config_mod_path), self.patch_version)
+
+    def set_target_version(self, config_mod_path: str, version: int):
+        with _LOCK:
+            self.target_versions[self.target_name(config_mod_path)] = version
+
+    def migrate_patch_version(self, config_mod_paths: list[str]):
+        # Older versions tracked a single patch version for every config mod, which is moved to the config mods patched first.
+        # Config mods found later start unpatched, so the old version never blocks compacting.
+        with _LOCK:
+            if self.patch_version == -1:
+                return
+            for config_mod_path in config_mod_paths:
+                self.target_versions.setdefault(self.target_name(config_mod_path), self.patch_version)
+            self.patch_version = -1
+
     def save(self):
-        config_file_content = {
-            self.Keys.STAGING: self.staging.replace('\\','\\\\'),
-            self.Keys.STARDEW_VALLEY: self.stardew_valley.replace('\\','\\\\'),
-            self.Keys.CONFIG_MOD_REGEX: self.config_mod_regex.pattern.replace('\\','\\\\'),
-            self.Keys.PATCH_VERSION: self.patch_version,
-        }
-
-        #jsonc_str = self.__CONFIG_FILE_CONTENT_TEMPLATE.format_map(config_file_content)
-        jsonc_str = self.__CONFIG_FILE_CONTENT_TEMPLATE
-        for key, value in config_file_content.items():
-            placeholder = f"{{{key}}}"
-            jsonc_str = jsonc_str.replace(placeholder, str(value))
-
-        with open(self.filepath(), 'w') as f:
-            f.write(jsonc_str)
\ No newline at end of file
+        with _LOCK:
+            config_file_content = {
+                self.Keys.STAGING: self.staging.replace('\\','\\\\'),
+                self.Keys.STARDEW_VALLEY: self.stardew_valley.replace('\\','\\\\'),
+                self.Keys.CONFIG_MOD_REGEX: self.config_mod_regex.pattern.replace('\\','\\\\'),
+                self.Keys.KEEP_BACKUPS: self.keep_backups,
+                self.Keys.PATCH_VERSION: self.patch_version,
+                self.Keys.TARGET_VERSIONS: json_dumps(self.target_versions),
+            }
+
+            #jsonc_str = self.__CONFIG_FILE_CONTENT_TEMPLATE.format_map(config_file_content)
+            jsonc_str = self.__CONFIG_FILE_CONTENT_TEMPLATE
+            for key, value in config_file_content.items():
+                placeholder = f"{{{key}}}"
+                jsonc_str = jsonc_str.replace(placeholder, str(value))
+
+            with open(self.filepath(), 'w') as f:
+                f.write(jsonc_str)
\ No newline at end of file
@@ -1,55 +1,65 @@
-from os import walk
 from os.path import join as path_join
 from os.path import relpath
+from typing import TYPE_CHECKING
 
 from lib.config import PatcherConfig
-from lib.patch import Patch, PatchFile, load_patches
-from lib.ui.console import ConsoleUserInterface
+from lib.discovery import DiscoveryCache, scan_for_configs
+from lib.hashcache import HashCache
+from lib.pathfilter import PathFilter
+from lib.patch import Patch, PatchFile, PatchIndex
+from lib.profiling import profiler
+from lib.snapshot import PatchedStateCache
+from lib.ui.headless import HeadlessUserInterface
 
+if TYPE_CHECKING:
+    from lib.ui.console import ConsoleUserInterface
 
-def _scan_for_configs_(configs_folder: str) -> list[str]:
-    configs = []
 
-    for root, dirs, files in walk(configs_folder):
-        if 'config.json' in files:
-            config_path = path_join(root, 'config.json')
-            configs.append(config_path)
-            # Prevent from further processing of subdirectories, as no more config.json files should be contained in the current folder.
-            dirs.clear()
+def create_patch_file(configs_folder: str, config: PatcherConfig, cui: 'ConsoleUserInterface | HeadlessUserInterface', path_filter: PathFilter | None = None):
+    patch_index = PatchIndex.load(config)
+    patch_versions = patch_index.versions()
+    patch_version = patch_versions[-1] + 1 if len(patch_versions) > 0 else 0
 
-    return configs
+    # Only the versions added since the last run are replayed to get the patched state of every config file.
+    patched_state_cache = PatchedStateCache.load(config)
+    patched_state_cache.update(patch_index)
 
-def create_patch_file(configs_folder: str, config: PatcherConfig, cui: ConsoleUserInterface):
-    patches = load_patches(config)
-    patch_version = list(sorted(patches.keys()))[-1] + 1 if len(patches) > 0 else 0
+    patched_configs_map: dict[str, dict] = {
+        path_join(configs_folder, rel_config_path): patched_config
+        for rel_config_path, patched_config
+        in patched_state_cache.states.items()
+    }
 
-    old_patches_map: dict[str, list[Patch]] = {}
+    discovery_cache = DiscoveryCache.load(config)
+    with profiler.section('discovery'):
+        cfg_files = scan_for_configs(configs_folder, discovery_cache)
+    discovery_cache.save()
 
-    for version in sorted(patches.keys()):
-        patchfile = patches[version]
-
-        for rel_config_path, value in patchfile.items():
-            config_path = path_join(configs_folder, rel_config_path)
-
-            if config_path not in old_patches_map:
-                old_patches_map[config_path] = list()
-            old_patches_map[config_path].append(value)
-
-    for cfg_file in _scan_for_configs_(configs_folder):
-        if cfg_file not in old_patches_map:
-            old_patches_map[cfg_file] = list()
+    for cfg_file in cfg_files:
+        if cfg_file not in patched_configs_map:
+            patched_configs_map[cfg_file] = dict()
 
     new_patches: dict[str, Patch] = {}
+    # The config files as they were last patched are the expected state before the new patch
+    hash_cache = HashCache.load(config)
 
-    for config_path, old_patches in old_patches_map.items():
+    for config_path, patched_config in patched_configs_map.items():
         rel_config_path = relpath(config_path, configs_folder)
+        # Config files not matching the filter are neither read nor compared
+        if path_filter is not None and not path_filter.matches(rel_config_path):
+            continue
 
-        patch = Patch.new_patch(config_path=config_path, old_patches=old_patches, rel_path=rel_config_path, cui=cui)
+        patch = Patch.new_patch(config_path=config_path, patched_config=patched_config, rel_path=rel_config_path, cui=cui, before=hash_cache.written_hash(config_path))
         if patch is not None:
             new_patches[rel_config_path] = patch
 
     if len(new_patches) > 0:
         PatchFile.create_and_save(version=patch_version, patches = new_patches, config=config)
         print(f"[ ] Created patch file version {patch_version}")
+        patched_state_cache.update(PatchIndex.load(config))
+
+        for rel_config_path in new_patches:
+            hash_cache.mark_written(path_join(configs_folder, rel_config_path))
+        hash_cache.save()
     else:
-        print("[!] Nothing to patch.")
\ No newline at end of file
+        print("[!] Nothing to patch.")
@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+from enum import Enum, IntEnum
+from typing import Any, Iterable, Optional, Tuple
+
+
+class Direction(Enum):
+    CONFIG = True
+    IGNORE = None
+    PATCH = False
+
+    @classmethod
+    def from_value(cls, value: Optional[bool]) -> 'Direction':
+        match value:
+            case cls.CONFIG.value:
+                return cls.CONFIG
+            case cls.IGNORE.value:
+                return cls.IGNORE
+            case cls.PATCH.value:
+                return cls.PATCH
+            case _:
+                raise ValueError
+
+    @classmethod
+    def from_name(cls, name: str) -> 'Direction':
+        try:
+            return cls[name.upper()]
+        except KeyError:
+            raise ValueError(f'Direction must be one of {", ".join(d.name for d in cls)}, but got "{name}" instead.')
+
+class DifferenceKind(IntEnum):
+    # Key only exists in the config file
+    CREATE = 0
+    # Key exists in both, but with different values
+    OVERWRITE = 1
+    # Key only exists in the patched config
+    REMOVE = 2
+
+Path = Tuple[str, ...]
+
+@dataclass
+class Difference():
+    path: Path
+    kind: DifferenceKind
+    on_disk_value: Any
+    patch_value: Any
+
+    @property
+    def key(self) -> str:
+        # Only for displaying and matching against policy globs, keys may contain dots themselves
+        return '.'.join(self.path)
+
+    def on_disk_text(self) -> str:
+        return 'REMOVE' if self.kind == DifferenceKind.REMOVE else str(self.on_disk_value)
+
+    def patch_text(self) -> str:
+        return 'IGNORE' if self.kind == DifferenceKind.CREATE else str(self.patch_value)
+
+def _leaves_(value: Any, path: Path, kind: DifferenceKind, diffs: list[Difference]) -> None:
+    # Adds every leaf of a value that only exists on one side. Empty dicts have no leaves.
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _leaves_(v, path + (k,), kind, diffs)
+    elif kind == DifferenceKind.CREATE:
+        diffs.append(Difference(path, kind, value, None))
+    else:
+        diffs.append(Difference(path, kind, None, value))
+
+def _diff_dicts_(on_disk: dict, patch: dict, path: Path, diffs: list[Difference]) -> None:
+    for k, on_disk_value in on_disk.items():
+        key_path = path + (k,)
+
+        if k not in patch:
+            _leaves_(on_disk_value, key_path, DifferenceKind.CREATE, diffs)
+            continue
+
+        patch_value = patch[k]
+        on_disk_is_dict, patch_is_dict = isinstance(on_disk_value, dict), isinstance(patch_value, dict)
+
+        if on_disk_is_dict and patch_is_dict:
+            # Identical subtrees are skipped without walking them
+            if on_disk_value != patch_value:
+                _diff_dicts_(on_disk_value, patch_value, key_path, diffs)
+        elif on_disk_is_dict or patch_is_dict:
+            # A dict and a value at the same key do not share any leaf
+            _leaves_(on_disk_value, key_path, DifferenceKind.CREATE, diffs)
+            _leaves_(patch_value, key_path, DifferenceKind.REMOVE, diffs)
+        elif on_disk_value != patch_value:
+            diffs.append(Difference(key_path, DifferenceKind.OVERWRITE, on_disk_value, patch_value))
+
+    for k, patch_value in patch.items():
+        if k not in on_disk:
+            _leaves_(patch_value, path + (k,), DifferenceKind.REMOVE, diffs)
+
+def differences(on_disk: dict, patch: dict) -> list[Difference]:
+    # Single pass over both nested dicts, the leaves are compared by their path
+    diffs: list[Difference] = []
+
+    if on_disk != patch:
+        _diff_dicts_(on_disk, patch, (), diffs)
+
+    return diffs
+
+def _set_path_(d: dict, path: Path, value: Any) -> None:
+    for key in path[:-1]:
+        d = d.setdefault(key, {})
+
+    d[path[-1]] = value
+
+def resolve(resolved_differences: Iterable[Tuple[Difference, Direction]]) -> Tuple[dict, dict, dict]:
+    create_d, overwrite_d, remove_d = dict(), dict(), dict()
+
+    for diff, direction in resolved_differences:
+        match direction, diff.kind:
+            case Direction.CONFIG, DifferenceKind.CREATE:
+                _set_path_(create_d, diff.path, diff.on_disk_value)
+            case Direction.CONFIG, DifferenceKind.OVERWRITE:
+                _set_path_(overwrite_d, diff.path, diff.on_disk_value)
+            case Direction.CONFIG, DifferenceKind.REMOVE:
+                _set_path_(remove_d, diff.path, {})
+            case Direction.PATCH, DifferenceKind.OVERWRITE:
+                _set_path_(overwrite_d, diff.path, diff.patch_value)
+            case _:
+                # IGNORE, or PATCH for a key that only exists on one side: the patched config already has the value of the patch
+                continue
+
+    return create_d, overwrite_d, remove_d
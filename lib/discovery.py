@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from json import dump as json_dump
+from json import load as json_load
+from os import scandir, stat
+from os.path import abspath, isfile, normcase
+from os.path import join as path_join
+from re import Pattern
+from time import time_ns
+
+from lib.backup import BackupStore
+from lib.config import PatcherConfig
+
+CONFIG_FILENAME = 'config.json'
+DISCOVERY_WORKERS = 8
+# Directories modified within this time are not cached, as a change in the same mtime tick would go unnoticed.
+_RACY_MTIME_NS = 2_000_000_000
+
+@dataclass
+class DirectoryEntry():
+    mtime_ns: int
+    has_config: bool
+    subdirs: list[str]
+
+    def __json__(self) -> list:
+        return [self.mtime_ns, self.has_config, self.subdirs]
+
+@dataclass
+class DiscoveryCache(dict[str, DirectoryEntry]):
+    # Listing of every scanned directory, keyed by its absolute path.
+    # Creating, deleting or renaming an entry changes the mtime of a directory, so a listing stays valid as long as it does not change.
+    FILENAME = 'config_patcher.discovery.json'
+    config: PatcherConfig
+
+    def __init__(self, config: PatcherConfig) -> None:
+        self.config = config
+
+    @classmethod
+    def filepath(cls, config: PatcherConfig) -> str:
+        return config.data_filepath(cls.FILENAME)
+
+    @classmethod
+    def load(cls, config: PatcherConfig) -> 'DiscoveryCache':
+        cache = cls(config)
+
+        filepath = cls.filepath(config)
+        if isfile(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    cache.update({k: DirectoryEntry(*v) for k, v in json_load(f).items()})
+            except Exception as e:
+                print(f"[!] Ignoring invalid discovery cache {filepath}: {e}")
+
+        return cache
+
+    def save(self) -> None:
+        with open(self.filepath(self.config), 'w') as f:
+            json_dump({k: e.__json__() for k, e in self.items()}, f, indent=None)
+
+    def list_directory(self, path: str) -> DirectoryEntry:
+        key = normcase(abspath(path))
+        mtime_ns = stat(path).st_mtime_ns
+
+        entry = self.get(key)
+        if entry is not None and entry.mtime_ns == mtime_ns:
+            return entry
+
+        has_config = False
+        subdirs: list[str] = []
+
+        with scandir(path) as it:
+            for dir_entry in it:
+                if dir_entry.is_dir(follow_symlinks=False):
+                    subdirs.append(dir_entry.name)
+                elif dir_entry.name == CONFIG_FILENAME and dir_entry.is_file():
+                    has_config = True
+
+        entry = DirectoryEntry(mtime_ns, has_config, subdirs)
+        if time_ns() - mtime_ns > _RACY_MTIME_NS:
+            self[key] = entry
+        else:
+            self.pop(key, None)
+
+        return entry
+
+def _scan_subtree_(path: str, cache: DiscoveryCache) -> list[str]:
+    entry = cache.list_directory(path)
+
+    if entry.has_config:
+        # No more config.json files should be contained in the subdirectories of a mod
+        return [path_join(path, CONFIG_FILENAME)]
+
+    configs: list[str] = []
+    for subdir in entry.subdirs:
+        configs.extend(_scan_subtree_(path_join(path, subdir), cache))
+    return configs
+
+def scan_for_configs(configs_folder: str, cache: DiscoveryCache) -> list[str]:
+    entry = cache.list_directory(configs_folder)
+
+    if entry.has_config:
+        return [path_join(configs_folder, CONFIG_FILENAME)]
+
+    # The subtrees are independent, so they are scanned in parallel. The order of the result stays the same.
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+        subtrees = executor.map(lambda subdir: _scan_subtree_(path_join(configs_folder, subdir), cache), entry.subdirs)
+
+        return [config for configs in subtrees for config in configs]
+
+def scan_for_config_mods(staging: str, config_mod_regex: Pattern, cache: DiscoveryCache) -> list[str]:
+    # Backup folders of older versions are in the staging folder and usually match the regex as well
+    return [
+        path_join(staging, folder)
+        for folder
+        in cache.list_directory(staging).subdirs
+        if config_mod_regex.match(folder) and not BackupStore.is_legacy_folder(folder)
+    ]
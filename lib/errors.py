@@ -0,0 +1,4 @@
+class PatcherError(ValueError):
+    # Invalid input of the user, e.g. a version or backup that does not exist or a file that is not valid JSON.
+    # Reported as a message without a traceback. A ValueError, so callers handling invalid values still catch it.
+    pass
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+from hashlib import sha256
+from json import dump as json_dump
+from json import load as json_load
+from os import stat
+from os.path import abspath, isfile, normcase
+
+from lib.config import PatcherConfig
+
+
+def content_hash(content: bytes) -> str:
+    return sha256(content).hexdigest()
+
+@dataclass
+class FileHash():
+    hash: str
+    size: int
+    mtime_ns: int
+    # Hash of the file when it was last written by the patcher, kept when the file is changed by something else
+    written: str | None = None
+
+    def __json__(self) -> list:
+        return [self.hash, self.size, self.mtime_ns, self.written]
+
+@dataclass
+class HashCache(dict[str, FileHash]):
+    # Content hashes of config files, keyed by their absolute path.
+    # An entry is only valid as long as size and mtime of the file did not change.
+    FILENAME = 'config_patcher.hashes.json'
+    config: PatcherConfig
+
+    def __init__(self, config: PatcherConfig) -> None:
+        self.config = config
+
+    @classmethod
+    def filepath(cls, config: PatcherConfig) -> str:
+        return config.data_filepath(cls.FILENAME)
+
+    @classmethod
+    def load(cls, config: PatcherConfig) -> 'HashCache':
+        cache = cls(config)
+
+        filepath = cls.filepath(config)
+        if isfile(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    cache.update({k: FileHash(*v) for k, v in json_load(f).items()})
+            except Exception as e:
+                print(f"[!] Ignoring invalid hash cache {filepath}: {e}")
+
+        return cache
+
+    def save(self) -> None:
+        with open(self.filepath(self.config), 'w') as f:
+            json_dump({k: e.__json__() for k, e in self.items()}, f, indent=None)
+
+    @staticmethod
+    def _key_(filepath: str) -> str:
+        return normcase(abspath(filepath))
+
+    def get_hash(self, filepath: str, content: bytes | None = None) -> str | None:
+        # content can be passed if the file was already read, so it does not have to be read again.
+        if not isfile(filepath):
+            return None
+
+        st = stat(filepath)
+        entry = self.get(self._key_(filepath))
+        if entry is not None and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+            return entry.hash
+
+        if content is None:
+            with open(filepath, 'rb') as f:
+                content = f.read()
+        hash = content_hash(content)
+
+        self[self._key_(filepath)] = FileHash(hash, st.st_size, st.st_mtime_ns, entry.written if entry is not None else None)
+        return hash
+
+    def set_hash(self, filepath: str, hash: str) -> None:
+        # Only called after the patcher wrote the file
+        st = stat(filepath)
+        self[self._key_(filepath)] = FileHash(hash, st.st_size, st.st_mtime_ns, hash)
+
+    def mark_written(self, filepath: str) -> None:
+        # e.g. the changes to a config file were made into a patch, so they are not reported as changed when it is applied
+        hash = self.get_hash(filepath)
+        if hash is not None:
+            self.set_hash(filepath, hash)
+
+    def written_hash(self, filepath: str) -> str | None:
+        entry = self.get(self._key_(filepath))
+        return entry.written if entry is not None else None
@@ -0,0 +1,142 @@
+from json import loads as json_loads
+from locale import getpreferredencoding
+from re import DOTALL as regex_DOTALL
+from re import compile as regex_compile
+from typing import Any
+
+from lib.errors import PatcherError
+
+try:
+    from orjson import JSONDecodeError as _FastJSONDecodeError
+    from orjson import loads as _fast_json_loads
+except ImportError: # orjson is optional
+    _fast_json_loads = None
+
+# JSON with comments and trailing commas, as written by SMAPI mods.
+# Only comment markers and trailing commas are looked at, everything in between is copied as a whole.
+# Whether a marker is inside of a string (e.g. in a URL) follows from the number of unescaped quotes before it,
+# which are counted in a single forward pass from one marker to the next.
+_COMMENT_REGEX = regex_compile(r'/[/*]')
+_TRAILING_COMMA_REGEX = regex_compile(r',[ \t\n\r]*+[\]}]')
+# Comments on their own lines cannot be inside of a string, so they are removed in bulk first
+_OWN_LINE_COMMENT_REGEX = regex_compile(r'\n[ \t]*+(?://[^\n]*+|/\*.*?\*/)', regex_DOTALL)
+
+def _json_loads_(json_str: str) -> Any:
+    if _fast_json_loads is not None:
+        try:
+            return _fast_json_loads(json_str)
+        except _FastJSONDecodeError:
+            pass # e.g. NaN, which only the json module accepts
+
+    return json_loads(json_str)
+
+class _StringTracker_():
+    # Tracks whether a position is inside of a string while moving forward only, so every quote is counted once
+    json_str: str
+    idx: int
+    in_string: bool
+
+    def __init__(self, json_str: str) -> None:
+        self.json_str = json_str
+        self.idx = 0
+        self.in_string = False
+
+    def is_in_string(self, idx: int) -> bool:
+        quotes = self.json_str.count('"', self.idx, idx)
+        escaped_idx = self.json_str.find('\\"', self.idx, idx) if quotes > 0 else -1
+        while escaped_idx != -1:
+            # The quote is escaped if it follows an odd number of backslashes
+            backslash_idx = escaped_idx
+            while backslash_idx > 0 and self.json_str[backslash_idx - 1] == '\\':
+                backslash_idx -= 1
+            quotes -= (escaped_idx + 1 - backslash_idx) % 2
+            escaped_idx = self.json_str.find('\\"', escaped_idx + 2, idx)
+
+        self.in_string ^= quotes % 2 == 1
+        self.idx = idx
+        return self.in_string
+
+    def skip(self, idx: int) -> None:
+        # Skipped text outside of strings, e.g. a comment, is not counted
+        self.idx = idx
+
+def _strip_inline_comments_(jsonc_str: str, own_lines_stripped: bool) -> str | None:
+    parts = []
+    copied_idx = 0
+    tracker = _StringTracker_(jsonc_str)
+    match = _COMMENT_REGEX.search(jsonc_str)
+    while match is not None:
+        idx = match.start()
+        if tracker.is_in_string(idx):
+            match = _COMMENT_REGEX.search(jsonc_str, idx + 1)
+            continue
+
+        if jsonc_str[idx + 1] == '/':
+            # The line break is kept
+            end = jsonc_str.find('\n', idx + 2)
+            end = len(jsonc_str) if end == -1 else end
+        else:
+            end = jsonc_str.find('*/', idx + 2)
+            end = len(jsonc_str) if end == -1 else end + 2
+            # A block comment that starts after other text on its line and continues on the next lines
+            # could have contained comments on their own lines, which must not be removed on their own
+            if own_lines_stripped and jsonc_str.find('\n', idx, end) != -1:
+                return None
+
+        parts.append(jsonc_str[copied_idx:idx])
+        copied_idx = end
+        tracker.skip(end)
+        match = _COMMENT_REGEX.search(jsonc_str, end)
+
+    if copied_idx == 0:
+        return jsonc_str
+    parts.append(jsonc_str[copied_idx:])
+    return ''.join(parts)
+
+def _strip_comments_(jsonc_str: str) -> str:
+    stripped_str = _strip_inline_comments_(_OWN_LINE_COMMENT_REGEX.sub('\n', jsonc_str), True)
+    return stripped_str if stripped_str is not None else _strip_inline_comments_(jsonc_str, False)
+
+def _strip_trailing_commas_(json_str: str) -> str:
+    parts = []
+    copied_idx = 0
+    tracker = _StringTracker_(json_str)
+    for match in _TRAILING_COMMA_REGEX.finditer(json_str):
+        idx = match.start()
+        if tracker.is_in_string(idx):
+            continue
+        parts.append(json_str[copied_idx:idx])
+        copied_idx = idx + 1
+
+    if copied_idx == 0:
+        return json_str
+    parts.append(json_str[copied_idx:])
+    return ''.join(parts)
+
+def strip_jsonc(jsonc_str: str) -> str:
+    # Comments are stripped first, so a trailing comma followed by a comment is found as well
+    return _strip_trailing_commas_(_strip_comments_(jsonc_str))
+
+def loads_jsonc(jsonc: str | bytes) -> Any:
+    if isinstance(jsonc, bytes):
+        try:
+            jsonc = jsonc.decode('utf-8-sig')
+        except UnicodeDecodeError: # written in text mode with the default encoding of the system
+            jsonc = jsonc.decode(getpreferredencoding(False))
+    else:
+        jsonc = jsonc.removeprefix('\ufeff')
+
+    # Most config files are plain JSON, which does not have to be stripped
+    try:
+        return _json_loads_(jsonc)
+    except ValueError:
+        return _json_loads_(strip_jsonc(jsonc))
+
+def read_jsonc(filepath: str) -> Any:
+    with open(filepath, 'rb') as f:
+        content = f.read()
+
+    try:
+        return loads_jsonc(content)
+    except ValueError as e:
+        raise PatcherError(f'{filepath} is not valid JSON: {e}') from e
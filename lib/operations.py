@@ -0,0 +1,141 @@
+from copy import deepcopy
+from enum import IntEnum
+from itertools import repeat
+from typing import Any, Iterable, NamedTuple
+
+
+class OperationKind(IntEnum):
+    CREATE_ON_MISSING = 0
+    OVERWRITE = 1
+    REMOVE = 2
+
+class Operation(NamedTuple):
+    path: tuple[str, ...]
+    kind: OperationKind
+    value: Any
+
+_MISSING = object()
+
+def _flatten_(d: dict, kind: OperationKind, parent_path: tuple[str, ...], operations: list[Operation]) -> None:
+    # Depth first, so operations sharing a path prefix are next to each other and keys keep their order in the config.
+    for key, value in d.items():
+        path = parent_path + (key,)
+
+        if isinstance(value, dict) and len(value) > 0:
+            _flatten_(value, kind, path, operations)
+        else:
+            operations.append(Operation(path, kind, value))
+
+def compile_operations(create_on_missing: dict, overwrite: dict, remove: dict) -> list[Operation]:
+    operations: list[Operation] = []
+
+    _flatten_(create_on_missing, OperationKind.CREATE_ON_MISSING, (), operations)
+    _flatten_(overwrite, OperationKind.OVERWRITE, (), operations)
+    _flatten_(remove, OperationKind.REMOVE, (), operations)
+
+    return operations
+
+def _copy_(value: Any) -> Any:
+    return deepcopy(value) if isinstance(value, (dict, list)) else value
+
+def apply_operations(operations: Iterable[Operation], config: dict) -> dict:
+    # containers[i] is the dict at path[:i] of the previous operation.
+    # An operation only changes its own key, so the containers of the common parent path can be reused.
+    containers: list[dict] = [config]
+    previous_path: tuple[str, ...] = ()
+
+    for path, kind, value in operations:
+        depth = 0
+        max_depth = min(len(path), len(previous_path), len(containers)) - 1
+        while depth < max_depth and path[depth] == previous_path[depth]:
+            depth += 1
+        del containers[depth+1:]
+        previous_path = path
+
+        container = containers[-1]
+        for key in path[len(containers)-1:-1]:
+            child = container.get(key, _MISSING)
+
+            if not isinstance(child, dict):
+                match kind:
+                    case OperationKind.CREATE_ON_MISSING:
+                        assert child is _MISSING # Invalid Config
+                        child = container[key] = {}
+                    case OperationKind.OVERWRITE:
+                        child = container[key] = {}
+                    case OperationKind.REMOVE:
+                        assert child is _MISSING # Invalid Config
+                        break
+
+            containers.append(child)
+            container = child
+        else:
+            key = path[-1]
+            current = container.get(key, _MISSING)
+
+            match kind:
+                case OperationKind.CREATE_ON_MISSING:
+                    if current is _MISSING:
+                        container[key] = _copy_(value)
+                    elif isinstance(value, dict):
+                        assert isinstance(current, dict) # Invalid Config
+                case OperationKind.OVERWRITE:
+                    if not (isinstance(value, dict) and isinstance(current, dict)):
+                        container[key] = _copy_(value)
+                case OperationKind.REMOVE:
+                    if current is not _MISSING:
+                        assert isinstance(value, dict)
+                        container.pop(key)
+
+    return config
+
+def pack_operations(operations: list[Operation]) -> tuple[tuple, tuple, tuple]:
+    # Paths, kinds and values as three tuples, which are pickled and unpickled without creating an Operation at a time in Python
+    if len(operations) < 1:
+        return (), (), ()
+    paths, kinds, values = zip(*operations)
+    return paths, kinds, values
+
+def unpack_operations(packed: tuple[tuple, tuple, tuple]) -> list[Operation]:
+    return list(map(tuple.__new__, repeat(Operation), zip(*packed)))
+
+def _is_prefix_(prefix: tuple[str, ...], path: tuple[str, ...]) -> bool:
+    return len(prefix) <= len(path) and path[:len(prefix)] == prefix
+
+def fold_operations(operations: list[Operation]) -> list[Operation]:
+    # Drops operations whose result is always replaced by a later OVERWRITE of the same path with a value,
+    # and CREATE_ON_MISSING operations of a value for a path that always exists already,
+    # without changing the result of apply_operations for any config, including the order of its keys.
+    # This is only the case if the path exists before the dropped operation, as it then neither adds a key nor a parent dict,
+    # and if no operation in between depends on the value, i.e. none for the path itself, one of its children or parents.
+    exists: set[tuple[str, ...]] = set()
+    candidates: dict[tuple[str, ...], int] = {}
+    dropped: set[int] = set()
+
+    for idx, (path, kind, value) in enumerate(operations):
+        existed = path in exists
+
+        if existed and kind == OperationKind.CREATE_ON_MISSING and not isinstance(value, dict):
+            dropped.add(idx)
+            continue
+
+        for candidate_path in [p for p in candidates if _is_prefix_(p, path) or _is_prefix_(path, p)]:
+            candidate_idx = candidates.pop(candidate_path)
+
+            if candidate_path == path and kind == OperationKind.OVERWRITE and not isinstance(value, dict):
+                dropped.add(candidate_idx)
+
+        # Paths that are guaranteed to exist after this operation, no matter which config it is applied to
+        match kind:
+            case OperationKind.CREATE_ON_MISSING:
+                exists.update(path[:depth] for depth in range(1, len(path) + 1))
+            case OperationKind.OVERWRITE:
+                exists.difference_update([p for p in exists if len(p) > len(path) and _is_prefix_(path, p)])
+                exists.update(path[:depth] for depth in range(1, len(path) + 1))
+            case OperationKind.REMOVE:
+                exists.difference_update([p for p in exists if _is_prefix_(path, p)])
+
+        if existed and kind != OperationKind.REMOVE:
+            candidates[path] = idx
+
+    return [operation for idx, operation in enumerate(operations) if idx not in dropped]
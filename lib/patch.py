@@ -1,18 +1,31 @@
+from copy import copy, deepcopy
 from dataclasses import dataclass
 from functools import cached_property
+from hashlib import sha256
 from json import dump as json_dump
 from json import dumps as json_dumps
 from json import load as json_load
 from json import loads as json_loads
-from os import listdir, makedirs
+from os import linesep, listdir, makedirs, replace, stat
 from os.path import exists as path_exists
 from os.path import isfile, dirname
 from os.path import join as path_join
 from re import compile as regex_compile
-from typing import Any
+from typing import TYPE_CHECKING, Any, Iterable, Tuple
 
 from lib.config import PatcherConfig
-from lib.ui.console import ConsoleUserInterface
+from lib.errors import PatcherError
+from lib.hashcache import HashCache, content_hash
+from lib.jsonc import loads_jsonc, read_jsonc
+from lib.patchcache import PatchCache
+from lib.pathfilter import PathFilter
+from lib.profiling import Profiler, profiler
+from lib.operations import Operation, OperationKind, apply_operations, compile_operations, pack_operations, unpack_operations
+from lib.transaction import ApplyTransaction
+from lib.ui.headless import HeadlessUserInterface
+
+if TYPE_CHECKING:
+    from lib.ui.console import ConsoleUserInterface
 
 PATCH_FOLDER_NAME = 'Patches'
 
@@ -24,158 +37,346 @@ def PATCH_FOLDER(config: PatcherConfig) -> str:
     
 @dataclass(init=False)
 class Patch():
-    create_on_missing: str
-    overwrite: str
-    remove: str
+    create_on_missing: dict[str, Any]
+    overwrite: dict[str, Any]
+    remove: dict
+    # Optional content hashes of the config file before and after applying the patch, see _apply_to_file_
+    before: str | None
+    after: str | None
+
+    @dataclass
+    class Keys():
+        CREATE_ON_MISSING = "create_on_missing"
+        OVERWRITE = "overwrite"
+        REMOVE = "remove"
+        BEFORE = "before"
+        AFTER = "after"
+
+    def __init__(self, create_on_missing: dict[str, Any], overwrite: dict[str, Any], remove: dict, before: str | None = None, after: str | None = None) -> None:
+        self.create_on_missing = create_on_missing
+        self.overwrite = overwrite
+        self.remove = remove
+        self.before = before
+        self.after = after
+
+    def __json__(self) -> dict[str, Any]:
+        # Empty operations are omitted to keep patch files small
+        json = {
+            self.Keys.CREATE_ON_MISSING: self.create_on_missing,
+            self.Keys.OVERWRITE: self.overwrite,
+            self.Keys.REMOVE: self.remove,
+        }
+        json = {k: v for k, v in json.items() if len(v) > 0}
+
+        if self.before is not None:
+            json[self.Keys.BEFORE] = self.before
+        if self.after is not None:
+            json[self.Keys.AFTER] = self.after
+
+        return json
 
-    @cached_property
-    def _create_on_missing(self) -> dict[str, Any]:
-        return json_loads(self.create_on_missing)
-    
-    @cached_property
-    def _overwrite(self) -> dict[str, Any]:
-        return json_loads(self.overwrite)
-    
-    @cached_property
-    def _remove(self) -> dict:
-        return json_loads(self.remove)
+    @classmethod
+    def from_json(cls, json: dict[str, Any]) -> 'Patch':
+        assert isinstance(json, dict)
 
-    def __init__(self, *args: str) -> None:
-        assert len(args) == 3
+        return cls(
+            json.get(cls.Keys.CREATE_ON_MISSING, {}),
+            json.get(cls.Keys.OVERWRITE, {}),
+            json.get(cls.Keys.REMOVE, {}),
+            json.get(cls.Keys.BEFORE),
+            json.get(cls.Keys.AFTER),
+        )
 
-        self.create_on_missing = args[0]
-        self.overwrite = args[1]
-        self.remove = args[2]
+    @classmethod
+    def from_v1_json(cls, json: list[str]) -> 'Patch':
+        # Version 1 patch files store every operation as a JSON string
+        assert isinstance(json, list) and len(json) == 3
 
-    def __json__(self) -> list[str]:
-        return [self.create_on_missing, self.overwrite, self.remove]
+        return cls(*(json_loads(operation) for operation in json))
 
     @classmethod
-    def from_dicts(cls, create_on_missing: dict = {}, overwrite: dict = {}, remove: dict = {}) -> 'Patch':
+    def from_dicts(cls, create_on_missing: dict | None = None, overwrite: dict | None = None, remove: dict | None = None) -> 'Patch':
         return cls(
-            json_dumps(create_on_missing),
-            json_dumps(overwrite),
-            json_dumps(remove),
+            create_on_missing if create_on_missing is not None else {},
+            overwrite if overwrite is not None else {},
+            remove if remove is not None else {},
         )
 
     @classmethod
-    def new_patch(cls, config_path: str, old_patches: list['Patch'], rel_path: str, cui: ConsoleUserInterface) -> 'Patch | None':
-        patched_config = {}
-
-        for patch in old_patches:
-            patched_config = patch._apply_(patched_config)
-
+    def new_patch(cls, config_path: str, patched_config: dict, rel_path: str, cui: 'ConsoleUserInterface | HeadlessUserInterface', before: str | None = None) -> 'Patch | None':
         if not isfile(config_path):
             return None
         
-        with open(config_path, 'r') as f:
-            on_disk_config = json_load(f)
+        on_disk_config = read_jsonc(config_path)
 
+        return cls.from_compare(on_disk_config=on_disk_config, patched_config=patched_config, rel_path=rel_path, cui=cui, before=before)
+
+    @classmethod
+    def from_compare(cls, on_disk_config: dict, patched_config: dict, rel_path: str, cui: 'ConsoleUserInterface | HeadlessUserInterface', before: str | None = None) -> 'Patch | None':
+        # before is the hash of the config file as it was last patched, if known
         create_on_missing, overwrite, remove = cui.compare(rel_path, on_disk=on_disk_config, patch=patched_config)
 
         if len(create_on_missing) == 0 and len(overwrite) == 0 and len(remove) == 0:
             return None
 
-        return Patch.from_dicts(
+        patch = Patch.from_dicts(
             create_on_missing=create_on_missing,
             overwrite=overwrite,
             remove=remove,
         )
+        patch.before = before
+        # The config file as it is written when the patch is applied to it
+        patch.after = content_hash(_serialize_config_(patch._apply_(deepcopy(on_disk_config))))
+
+        return patch
     
-    @staticmethod
-    def _apply_on_missing_(on_disk: dict, patch: dict) -> None:
-        for key, patch_value in patch.items():
-            if key not in on_disk:
-                on_disk[key] = patch_value
-            else:
-                if isinstance(patch_value, dict):
-                    on_disk_value = on_disk[key]
-
-                    assert isinstance(on_disk_value, dict) # Invalid Config
-
-                    Patch._apply_on_missing_(on_disk_value, patch_value)
-
-    @staticmethod
-    def _apply_overwrite_(on_disk: dict, patch: dict) -> None:
-        for key, patch_value in patch.items():
-            if (
-                isinstance(patch_value, dict)
-                and key in on_disk
-                and isinstance((on_disk_value := on_disk[key]), dict)
-            ):
-                Patch._apply_overwrite_(on_disk_value, patch_value)
-            else:
-                on_disk[key] = patch_value
-
-    @staticmethod
-    def _apply_remove_(on_disk: dict, patch: dict) -> None:
-        for key, patch_value in patch.items():
-            if key not in on_disk:
-                continue
+    @cached_property
+    def operations(self) -> list[Operation]:
+        return compile_operations(self.create_on_missing, self.overwrite, self.remove)
+
+    # Pickled by lib.patchcache together with the compiled operations
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        if 'operations' in state:
+            state['operations'] = pack_operations(state['operations'])
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        if 'operations' in state:
+            state['operations'] = unpack_operations(state['operations'])
+        self.__dict__.update(state)
+
+    def _apply_(self, config: dict | None) -> dict:
+        if config is None:
+            config = {}
 
-            assert isinstance(patch_value, dict)
+        return apply_operations(self.operations, config)       
 
-            if len(patch_value) > 0: # contains sub keys
-                on_disk_value = on_disk[key]
-                assert isinstance(on_disk_value, dict)
+    def apply(self, config_path: str, hash_cache: HashCache | None = None, transaction: ApplyTransaction | None = None) -> bool:
+        return _apply_to_file_(self, config_path, hash_cache, transaction)
 
-                Patch._apply_remove_(on_disk_value, patch_value)
-            else:
-                on_disk.pop(key)
+@dataclass(init=False)
+class BaselinePatch():
+    # The operations of all versions of a baseline patch file for one config file, see lib.compaction.
+    # They are stored compiled, as the versions can not be merged into a single Patch (see ComposedPatch).
+    operations: list[Operation]
+    before: str | None
+    after: str | None
+
+    @dataclass
+    class Keys():
+        OPERATIONS = "operations"
+        BEFORE = "before"
+        AFTER = "after"
+
+    def __init__(self, operations: list[Operation], before: str | None = None, after: str | None = None) -> None:
+        self.operations = operations
+        self.before = before
+        self.after = after
+
+    def __json__(self) -> dict[str, Any]:
+        json: dict[str, Any] = {self.Keys.OPERATIONS: [[list(path), int(kind), value] for path, kind, value in self.operations]}
+
+        if self.before is not None:
+            json[self.Keys.BEFORE] = self.before
+        if self.after is not None:
+            json[self.Keys.AFTER] = self.after
+
+        return json
+
+    @classmethod
+    def from_json(cls, json: dict[str, Any] | list[list]) -> 'BaselinePatch':
+        # The first baseline patch files only contained the list of operations
+        if isinstance(json, list):
+            json = {cls.Keys.OPERATIONS: json}
+        assert isinstance(json, dict)
+
+        return cls(
+            [Operation(tuple(path), OperationKind(kind), value) for path, kind, value in json[cls.Keys.OPERATIONS]],
+            json.get(cls.Keys.BEFORE),
+            json.get(cls.Keys.AFTER),
+        )
 
+    def __getstate__(self) -> dict[str, Any]:
+        return {**self.__dict__, 'operations': pack_operations(self.operations)}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update({**state, 'operations': unpack_operations(state['operations'])})
 
     def _apply_(self, config: dict | None) -> dict:
         if config is None:
             config = {}
 
-        self._apply_on_missing_(config, self._create_on_missing)
-        self._apply_overwrite_(config, self._overwrite)
-        self._apply_remove_(config, self._remove)
+        return apply_operations(self.operations, config)
+
+@dataclass(init=False)
+class ComposedPatch():
+    # The three operation dicts of a Patch are always applied in the fixed order on_missing, overwrite, remove.
+    # Two patches can therefore not be merged into a single Patch without changing the result
+    # (e.g. remove 'a' followed by overwrite 'a' with a dict), so consecutive patches are kept as ordered stages
+    # whose compiled operations are applied in one pass, which keeps one read and one write per config file.
+    stages: list[Patch | BaselinePatch]
+
+    def __init__(self, stages: list[Patch | BaselinePatch] | None = None) -> None:
+        self.stages = list(stages) if stages is not None else []
+
+    def append(self, patch: Patch | BaselinePatch) -> None:
+        self.stages.append(patch)
+        self.__dict__.pop('operations', None)
+
+    @cached_property
+    def operations(self) -> list[Operation]:
+        return [operation for stage in self.stages for operation in stage.operations]
+
+    @property
+    def before(self) -> str | None:
+        return self.stages[0].before if len(self.stages) > 0 else None
+
+    @property
+    def after(self) -> str | None:
+        return self.stages[-1].after if len(self.stages) > 0 else None
+
+    def _apply_(self, config: dict | None) -> dict:
+        if config is None:
+            config = {}
+
+        return apply_operations(self.operations, config)
+
+    def apply(self, config_path: str, hash_cache: HashCache | None = None, transaction: ApplyTransaction | None = None) -> bool:
+        return _apply_to_file_(self, config_path, hash_cache, transaction)
+
+def _serialize_config_(config: dict) -> bytes:
+    # Same bytes as json.dump(config, f, indent=2) into a file opened in text mode
+    return json_dumps(config, indent=2).replace('\n', linesep).encode()
+
+# The steps of patching a config file, which are either run one after another by _apply_to_file_,
+# or as stages of the pipeline in lib.pipeline, so reading, patching and writing of different files overlap.
+def read_config(config_path: str, hash_cache: HashCache | None) -> Tuple[bytes | None, str | None]:
+    if not isfile(config_path):
+        return None, None
+
+    with open(config_path, 'rb') as f:
+        content = f.read()
+    old_hash = hash_cache.get_hash(config_path, content) if hash_cache is not None else content_hash(content)
+
+    return content, old_hash
+
+def is_patched(patch: Patch | ComposedPatch, config_path: str, old_hash: str | None, hash_cache: HashCache | None) -> bool:
+    if old_hash is None:
+        return False
+
+    # Already patched, e.g. by a lost or reset patch version, or a config mod shared with another profile
+    if old_hash == patch.after:
+        return True
+
+    # before is the hash of the config file the patch was created from, which is only the same for this config file
+    # if it was not changed since the patcher last wrote it. Config files never written by the patcher are not compared.
+    written_hash = hash_cache.written_hash(config_path) if hash_cache is not None else None
+    if patch.before is not None and old_hash != patch.before and written_hash is not None and old_hash != written_hash:
+        print(f'[!] {config_path} was changed since it was last patched, the changes may be overwritten.')
+
+    return False
+
+def patch_config(patch: Patch | ComposedPatch, content: bytes | None) -> Tuple[bytes, str]:
+    config = loads_jsonc(content) if content is not None else None
+
+    config = patch._apply_(config)
+    new_content = _serialize_config_(config)
+
+    return new_content, content_hash(new_content)
+
+def write_config(config_path: str, new_content: bytes, new_hash: str, hash_cache: HashCache | None, transaction: ApplyTransaction | None = None) -> None:
+    # TODO: add option to remove config files
+    folder = dirname(config_path)
+    if not path_exists(folder):
+        makedirs(folder, exist_ok=True)
+
+    # Written files only replace the config file once the transaction is committed
+    if transaction is not None:
+        transaction.stage(config_path, new_content, new_hash)
+        return
+
+    with open(config_path, 'wb') as f:
+        f.write(new_content)
 
-        return config       
+    if hash_cache is not None:
+        hash_cache.set_hash(config_path, new_hash)
 
-    def apply(self, config_path: str) -> None:
-        if isfile(config_path):
-            with open(config_path, 'r') as f:
-                config = json_load(f)
-        else:
-            config = None
+def _apply_to_file_(patch: Patch | ComposedPatch, config_path: str, hash_cache: HashCache | None, transaction: ApplyTransaction | None = None) -> bool:
+    content, old_hash = read_config(config_path, hash_cache)
+    if is_patched(patch, config_path, old_hash, hash_cache):
+        return False
 
-        config = self._apply_(config)
-        # TODO: add option to remove config files
+    new_content, new_hash = patch_config(patch, content)
 
-        folder = dirname(config_path)
-        if not path_exists(folder):
-            makedirs(folder)
+    # Unchanged files are not written, so their mtime stays the same
+    if old_hash == new_hash:
+        return False
 
-        with open(config_path, 'w') as f:
-            json_dump(config, f, indent=2)
+    write_config(config_path, new_content, new_hash, hash_cache, transaction)
+    return True
 
 @dataclass
-class PatchFile(dict[str, Patch]):
+class PatchFile(dict[str, Patch | BaselinePatch]):
     FILENAME_TEMPLATE = 'v{version}.patch'
     FILENAME_PATTERN = r'^[vV](\d+)\.patch$'
     FILENAME_REGEX = regex_compile(FILENAME_PATTERN)
+    # Version 1: {rel_config_path: [create_on_missing, overwrite, remove]} with every operation as a JSON string
+    # Version 2: {"format": 2, "patches": {rel_config_path: {"create_on_missing": {...}, "overwrite": {...}, "remove": {...}}}}
+    # Baseline: {"format": 2, "baseline": first_version, "patches": {rel_config_path: [[path, kind, value], ...]}}
+    #   replaces all versions from first_version up to its own version
+    FORMAT = 2
     version: int
+    format: int
+    baseline: int | None
+
+    @dataclass
+    class Keys():
+        FORMAT = "format"
+        BASELINE = "baseline"
+        PATCHES = "patches"
     
-    def __init__(self, filename: str, config: PatcherConfig):
-        if not (match := self.FILENAME_REGEX.match(filename)):
-            raise ExpectedError(f'Patch file must be of pattern "{self.FILENAME_PATTERN}", put got "{filename}" instead.')
-        
-        filepath = path_join(PATCH_FOLDER(config), filename)
-        assert isfile(filepath)
-
-        version = int(match.group(1))
+    def __init__(self, filename: str, config: PatcherConfig, json: Any = None):
+        self.version = self.parse_version(filename)
 
-        self.version = version
+        if json is None:
+            filepath = path_join(PATCH_FOLDER(config), filename)
+            assert isfile(filepath)
 
-        with open(filepath, 'r') as f:
-            json = json_load(f)
+            with open(filepath, 'r') as f:
+                json = json_load(f)
 
         assert isinstance(json, dict)
 
-        for key, value in json.items():
-            self[key] = Patch(*value)
+        # A version 1 file can not contain an integer as value, as every value is a list
+        self.format = json.get(self.Keys.FORMAT) if isinstance(json.get(self.Keys.FORMAT), int) else 1
+        self.baseline = json.get(self.Keys.BASELINE) if self.format == self.FORMAT else None
+
+        match self.format:
+            case 1:
+                for key, value in json.items():
+                    self[key] = Patch.from_v1_json(value)
+            case self.FORMAT:
+                patches = json[self.Keys.PATCHES]
+                assert isinstance(patches, dict)
+
+                for key, value in patches.items():
+                    self[key] = Patch.from_json(value) if self.baseline is None else BaselinePatch.from_json(value)
+            case _:
+                raise ValueError(f'Unsupported patch file format {self.format}, update the Config Patcher.')
+
+    def select(self, path_filter: PathFilter) -> 'PatchFile':
+        selected = copy(self)
+        for rel_config_path in [rel_config_path for rel_config_path in selected if not path_filter.matches(rel_config_path)]:
+            del selected[rel_config_path]
+        return selected
+
+    @classmethod
+    def parse_version(cls, filename: str) -> int:
+        if not (match := cls.FILENAME_REGEX.match(filename)):
+            raise ExpectedError(f'Patch file must be of pattern "{cls.FILENAME_PATTERN}", put got "{filename}" instead.')
+
+        return int(match.group(1))
 
     @classmethod
     def create_and_save(cls, version: int, patches: dict[str, Patch], config: PatcherConfig) -> None:
@@ -189,28 +390,226 @@ class PatchFile(dict[str, Patch]):
         if path_exists(filepath):
             raise ValueError(f"File {filename} already exists")
         
-        json_patches = {k: p.__json__() for k, p in patches.items()}
-        
-        with open(filepath, 'w') as f:
-            json_dump(json_patches, f, indent=None)
-
-def load_patches(config: PatcherConfig) -> dict[int, PatchFile]:
-    patchfiles: dict[int, PatchFile] = {}
-    folder = PATCH_FOLDER(config)
-    for item in listdir(folder):
-        path = path_join(folder, item)
-        
-        if not isfile(path):
+        cls._save_(filepath, patches)
+
+    @classmethod
+    def save_baseline(cls, filename: str, patches: dict[str, BaselinePatch], baseline: int, config: PatcherConfig) -> None:
+        cls._save_(path_join(PATCH_FOLDER(config), filename), patches, baseline=baseline)
+
+    @classmethod
+    def _save_(cls, filepath: str, patches: dict[str, Patch] | dict[str, BaselinePatch], baseline: int | None = None) -> None:
+        json_patchfile: dict[str, Any] = {cls.Keys.FORMAT: cls.FORMAT}
+        if baseline is not None:
+            json_patchfile[cls.Keys.BASELINE] = baseline
+        json_patchfile[cls.Keys.PATCHES] = {k: p.__json__() for k, p in patches.items()}
+
+        temp_filepath = f'{filepath}.tmp'
+        with open(temp_filepath, 'w') as f:
+            json_dump(json_patchfile, f, indent=None, separators=(',', ':'))
+        replace(temp_filepath, filepath)
+
+    def convert(self, filename: str, config: PatcherConfig) -> bool:
+        if self.format == self.FORMAT:
+            return False
+
+        self._save_(path_join(PATCH_FOLDER(config), filename), self)
+        self.format = self.FORMAT
+        return True
+
+@dataclass
+class PatchIndexEntry():
+    version: int
+    size: int
+    mtime_ns: int
+    hash: str
+    paths: list[str]
+    # First version replaced by a baseline patch file
+    baseline: int | None = None
+
+    def __json__(self) -> list:
+        return [self.version, self.size, self.mtime_ns, self.hash, self.paths, self.baseline]
+
+@dataclass
+class PatchIndex(dict[str, PatchIndexEntry]):
+    # Maps the filename of every patch file to its version, stat, content hash and the config files it patches.
+    # Only patch files whose size or mtime changed since the last run have to be read to keep the index up to date.
+    FILENAME = 'config_patcher.index.json'
+    config: PatcherConfig
+    _patchfiles: dict[int, PatchFile]
+    _patch_cache: PatchCache
+
+    def __init__(self, config: PatcherConfig) -> None:
+        self.config = config
+        self._patchfiles = {}
+        self._patch_cache = PatchCache(config)
+
+    @classmethod
+    def filepath(cls, config: PatcherConfig) -> str:
+        return config.data_filepath(cls.FILENAME)
+
+    @classmethod
+    def load(cls, config: PatcherConfig) -> 'PatchIndex':
+        index = cls(config)
+
+        cached: dict[str, PatchIndexEntry] = {}
+        index_filepath = cls.filepath(config)
+        if isfile(index_filepath):
+            try:
+                with open(index_filepath, 'r') as f:
+                    cached = {k: PatchIndexEntry(*v) for k, v in json_load(f).items()}
+            except Exception as e:
+                print(f"[!] Ignoring invalid patch index {index_filepath}: {e}")
+
+        changed = index._refresh_(cached)
+        if changed:
+            index.save()
+            index._patch_cache.prune({entry.hash for entry in index.values()})
+
+        return index
+
+    def _refresh_(self, cached: dict[str, PatchIndexEntry]) -> bool:
+        folder = PATCH_FOLDER(self.config)
+        changed = False
+
+        for item in (listdir(folder) if path_exists(folder) else []):
+            path = path_join(folder, item)
+
+            if not isfile(path):
+                continue
+
+            try:
+                version = PatchFile.parse_version(item)
+            except ExpectedError: # Ingore this error type
+                continue
+
+            st = stat(path)
+            entry = cached.get(item)
+            if entry is not None and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                self[item] = entry
+                continue
+
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+
+                pf = PatchFile(item, self.config, json=json_loads(content))
+            except Exception as e:
+                raise PatcherError(f'Invalid patch file {path}: {e}') from e
+
+            hash = sha256(content).hexdigest()
+
+            # The file was parsed anyway, keep it in case it is requested later on.
+            self._patchfiles[version] = pf
+            self._patch_cache.save(hash, pf)
+            self[item] = PatchIndexEntry(
+                version=version,
+                size=st.st_size,
+                mtime_ns=st.st_mtime_ns,
+                hash=hash,
+                paths=list(pf.keys()),
+                baseline=pf.baseline,
+            )
+            changed = True
+
+        return changed or self.keys() != cached.keys()
+
+    def save(self) -> None:
+        with open(self.filepath(self.config), 'w') as f:
+            json_dump({k: e.__json__() for k, e in self.items()}, f, indent=None)
+
+    def versions(self) -> list[int]:
+        return sorted(entry.version for entry in self.values())
+
+    def baseline(self) -> PatchIndexEntry | None:
+        versions = self.versions()
+        if len(versions) < 1:
+            return None
+
+        entry = self[self.filename(versions[0])]
+        return entry if entry.baseline is not None else None
+
+    def pending_versions(self, current_version: int) -> list[int]:
+        # The versions that have to be applied to a config mod at current_version, in order.
+        # The history either starts at version 0 or with a baseline patch file replacing all versions before it.
+        versions = self.versions()
+        if len(versions) < 1:
+            return []
+
+        baseline = self.baseline()
+        first_version = baseline.baseline if baseline is not None else versions[0]
+        if first_version != 0 or versions != list(range(versions[0], versions[-1] + 1)):
+            raise PatcherError(f'Patch versions must be contiguous starting at version 0 or a baseline, but got: {", ".join(map(str, versions))}')
+
+        if baseline is not None and first_version <= current_version < baseline.version:
+            raise PatcherError(f'Version {current_version} was compacted into the baseline {self.filename(baseline.version)}, so the remaining versions can not be applied to the config mod. Restore an unpatched backup of it first.')
+
+        return [version for version in versions if version > current_version]
+
+    def filename(self, version: int) -> str:
+        for filename, entry in self.items():
+            if entry.version == version:
+                return filename
+        raise KeyError(version)
+
+    def load_patchfile(self, version: int, path_filter: PathFilter | None = None) -> PatchFile:
+        # Patch files are always loaded and cached completely, so a filter only selects from them
+        filename = self.filename(version)
+
+        with profiler.section(PatchFile.FILENAME_TEMPLATE.format(version=version), Profiler.VERSION):
+            if version not in self._patchfiles and (cached := self._patch_cache.load(self[filename].hash)) is not None:
+                self._patchfiles[version] = cached
+
+            if version not in self._patchfiles:
+                try:
+                    patchfile = PatchFile(filename, self.config)
+                except Exception as e:
+                    raise PatcherError(f'Invalid patch file {path_join(PATCH_FOLDER(self.config), filename)}: {e}') from e
+
+                self._patchfiles[version] = patchfile
+                self._patch_cache.save(self[filename].hash, patchfile)
+
+            patchfile = self._patchfiles[version]
+            return patchfile if path_filter is None else patchfile.select(path_filter)
+
+def load_patches(config: PatcherConfig, versions: Iterable[int] | None = None, index: PatchIndex | None = None, path_filter: PathFilter | None = None) -> dict[int, PatchFile]:
+    # With a path_filter, versions without a matching config file are not loaded at all,
+    # which is known from the paths in the index without opening the patch file.
+    if index is None:
+        index = PatchIndex.load(config)
+
+    if versions is None:
+        versions = index.versions()
+
+    if path_filter is not None:
+        versions = [version for version in versions if path_filter.matches_any(index[index.filename(version)].paths)]
+
+    return {version: index.load_patchfile(version, path_filter) for version in versions}
+
+def convert_patch_files(config: PatcherConfig) -> list[str]:
+    index = PatchIndex.load(config)
+    converted: list[str] = []
+
+    for filename, entry in sorted(index.items(), key=lambda item: item[1].version):
+        if index.load_patchfile(entry.version).convert(filename, config):
+            converted.append(filename)
+
+    return converted
+
+def compose_patches(patchfiles: dict[int, PatchFile], versions: Iterable[int]) -> dict[str, ComposedPatch]:
+    composed: dict[str, ComposedPatch] = {}
+
+    for version in versions:
+        # Versions can be missing if they were skipped by a path filter
+        if version not in patchfiles:
             continue
 
-        try:
-            pf = PatchFile(item, config)
-            patchfiles[pf.version] = pf
-        except ExpectedError: # Ingore this error type
-            pass
-        except Exception as e:
-            print(f"Error for {item}: {e}")
-            raise RuntimeError(item, e)
-            
-
-    return patchfiles
\ No newline at end of file
+        with profiler.section(PatchFile.FILENAME_TEMPLATE.format(version=version), Profiler.VERSION):
+            for rel_config_path, patch in patchfiles[version].items():
+                # Compile the operations here, so the time is accounted to the version and not to the first config file
+                _ = patch.operations
+
+                if rel_config_path not in composed:
+                    composed[rel_config_path] = ComposedPatch()
+                composed[rel_config_path].append(patch)
+
+    return composed
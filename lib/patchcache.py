@@ -0,0 +1,75 @@
+from gc import disable as gc_disable
+from gc import enable as gc_enable
+from gc import isenabled as gc_isenabled
+from os import listdir, makedirs, remove, replace
+from os.path import isdir, isfile
+from os.path import join as path_join
+from pickle import HIGHEST_PROTOCOL
+from pickle import dump as pickle_dump
+from pickle import load as pickle_load
+from typing import Any
+
+from lib.config import PatcherConfig
+
+
+class PatchCache():
+    # Parsed patch files with their compiled operations, pickled by the content hash of the patch file.
+    # The hash is taken from the patch index, which reads a patch file again if its size or mtime changed,
+    # so a changed patch file gets a new cache file and loading it never needs JSON parsing.
+    FOLDER_NAME = 'config_patcher.patch_cache'
+    EXTENSION = '.pickle'
+    # Has to be increased if the pickled classes change, so older cache files are not used
+    FORMAT = 1
+
+    config: PatcherConfig
+
+    def __init__(self, config: PatcherConfig) -> None:
+        self.config = config
+
+    @property
+    def folder(self) -> str:
+        return self.config.data_filepath(self.FOLDER_NAME)
+
+    def _filepath_(self, hash: str) -> str:
+        return path_join(self.folder, f'{hash}{self.EXTENSION}')
+
+    def load(self, hash: str) -> Any | None:
+        filepath = self._filepath_(hash)
+        if not isfile(filepath):
+            return None
+
+        # Unpickling creates many objects at once, which would trigger the garbage collector again and again
+        gc_was_enabled = gc_isenabled()
+        gc_disable()
+        try:
+            with open(filepath, 'rb') as f:
+                format, patchfile = pickle_load(f)
+        except Exception as e:
+            print(f"[!] Ignoring invalid patch cache {filepath}: {e}")
+            return None
+        finally:
+            if gc_was_enabled:
+                gc_enable()
+
+        return patchfile if format == self.FORMAT else None
+
+    def save(self, hash: str, patchfile: dict) -> None:
+        # Compile the operations first, so they are cached as well
+        for patch in patchfile.values():
+            _ = patch.operations
+
+        makedirs(self.folder, exist_ok=True)
+        filepath = self._filepath_(hash)
+        temp_filepath = f'{filepath}.tmp'
+        with open(temp_filepath, 'wb') as f:
+            pickle_dump((self.FORMAT, patchfile), f, protocol=HIGHEST_PROTOCOL)
+        replace(temp_filepath, filepath)
+
+    def prune(self, hashes: set[str]) -> None:
+        # Removes the cache files of patch files that were changed or deleted
+        if not isdir(self.folder):
+            return
+
+        for item in listdir(self.folder):
+            if item.removesuffix(self.EXTENSION) not in hashes:
+                remove(path_join(self.folder, item))
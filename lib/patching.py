@@ -1,41 +1,128 @@
-from datetime import datetime
-from os.path import basename, isdir
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os.path import join as path_join
-from os.path import pardir
-from shutil import make_archive
+from typing import Tuple
 
+from lib.backup import BackupStore
 from lib.config import PatcherConfig
-from lib.patch import load_patches
+from lib.hashcache import HashCache
+from lib.pathfilter import PathFilter
+from lib.patch import ComposedPatch, PatchIndex, compose_patches, load_patches
+from lib.pipeline import apply_pipelined
+from lib.profiling import Profiler, profiler
+from lib.transaction import ApplyTransaction
 
 
-def patch(config_mod_path: str, config: PatcherConfig):
+def _apply_composed_patch_(composed_patch: ComposedPatch, config_mod_path: str, rel_config_path: str, hash_cache: HashCache, transaction: ApplyTransaction) -> bool:
+    with profiler.section(rel_config_path, Profiler.FILE):
+        return composed_patch.apply(path_join(config_mod_path, rel_config_path), hash_cache, transaction)
+
+def _apply_composed_patches_(config_mod_path: str, composed_patches: dict[str, ComposedPatch], hash_cache: HashCache, transaction: ApplyTransaction, jobs: int) -> Tuple[dict[str, bool], dict[str, Exception]]:
+    written: dict[str, bool] = {}
+    errors: dict[str, Exception] = {}
+
+    # Every config file is contained in exactly one ComposedPatch with its versions in order,
+    # so files can be patched independently of each other.
+    if jobs > 1:
+        return apply_pipelined(config_mod_path, composed_patches, hash_cache, transaction, jobs)
+
+    for rel_config_path, composed_patch in composed_patches.items():
+        try:
+            written[rel_config_path] = _apply_composed_patch_(composed_patch, config_mod_path, rel_config_path, hash_cache, transaction)
+        except Exception as e:
+            errors[rel_config_path] = e
+
+    return written, errors
+
+def _patch_target_(config_mod_path: str, config: PatcherConfig, composed_patches: dict[str, ComposedPatch], patch_version: int | None, hash_cache: HashCache, jobs: int):
+    target_name = config.target_name(config_mod_path)
+
     #region Backup config_mod
-    backup_path = path_join(
-        config_mod_path,
-        pardir,
-        f'{basename(config_mod_path)}_{datetime.now().strftime('%Y-%m-%dT%H-%M')}'
-    )
-    if isdir(config_mod_path):
-        make_archive(backup_path, 'zip', config_mod_path)
-        print('Backup created successfully at: %s' % backup_path)
+    with profiler.section('backup'):
+        backup_store = BackupStore(config_mod_path, config)
+        timestamp = backup_store.backup(config.target_version(config_mod_path))
+        pruned = backup_store.prune(config.keep_backups) if timestamp is not None else []
+    if timestamp is not None:
+        print(f'Backup {timestamp} created successfully at: {backup_store.folder}')
+    if len(pruned) > 0:
+        print(f'> Deleted {len(pruned)} old backups of {target_name}, keeping the latest {config.keep_backups}')
     #endregion Backup config_mod
 
-    patchfiles = load_patches(config)
+    with profiler.section('apply'):
+        transaction = ApplyTransaction.begin(config, config_mod_path, patch_version)
+        try:
+            written, errors = _apply_composed_patches_(config_mod_path, composed_patches, hash_cache, transaction, jobs)
+        except BaseException:
+            # e.g. Ctrl-C, none of the config files were replaced yet
+            transaction.rollback()
+            raise
+
+    written_count = sum(written.values())
+
+    if len(errors) > 0:
+        transaction.rollback()
+        for rel_config_path, e in sorted(errors.items()):
+            print(f'[!] Error for {target_name}/{rel_config_path}: {e!r}')
+        raise RuntimeError(f'Patching failed for {len(errors)} config files of {target_name}, no config file was changed and the patch version was not updated.')
+
+    with profiler.section('commit'):
+        # Replaces all written config files and saves the patch version
+        transaction.commit(hash_cache)
+
+    print(f'> Patched {len(written)} config files of {target_name} ({written_count} written, {len(written) - written_count} unchanged).')
+
+def patch(config_mod_paths: list[str], config: PatcherConfig, jobs: int = 1, path_filter: PathFilter | None = None):
+    config.migrate_patch_version(config_mod_paths)
+
+    # Every patch file is loaded and compiled once, no matter how many config mods are patched
+    with profiler.section('load_patches'):
+        patch_index = PatchIndex.load(config)
+        max_version = patch_index.versions()[-1]
+
+        # Config mods at the same version share the same pending versions and composed patches.
+        # With a path filter, all versions are applied again to the matching config files,
+        # and the tracked patch version is not changed, as the other config files are not patched.
+        current_versions = {config_mod_path: config.target_version(config_mod_path) if path_filter is None else -1 for config_mod_path in config_mod_paths}
+        pending_versions = {version: patch_index.pending_versions(version) for version in sorted(set(current_versions.values()))}
+        versions = sorted(set(version for pending in pending_versions.values() for version in pending))
+
+        patchfiles = load_patches(config, versions=versions, index=patch_index, path_filter=path_filter)
+
+    if path_filter is not None:
+        print(f'> Applying {len(patchfiles)} of {len(versions)} versions to the config files matching {path_filter.describe()}...')
+    elif len(versions) > 0:
+        print(f'> Composing versions {versions[0]} to {max_version}...')
+    with profiler.section('compose'):
+        composed_patches_by_version = {
+            version: compose_patches(patchfiles, pending)
+            for version, pending
+            in pending_versions.items()
+        }
+
+    patch_version = max_version if path_filter is None else None
+    hash_cache = HashCache.load(config)
+    failed: dict[str, Exception] = {}
 
-    patch_versions = list(sorted(patchfiles.keys()))
-    min_version = config.patch_version + 1
-    max_version = patch_versions[-1]
-    assert patch_versions == list(range(max_version+1))
+    try:
+        if len(config_mod_paths) == 1:
+            config_mod_path = config_mod_paths[0]
+            _patch_target_(config_mod_path, config, composed_patches_by_version[current_versions[config_mod_path]], patch_version, hash_cache, jobs)
+        else:
+            with ThreadPoolExecutor(max_workers=len(config_mod_paths)) as executor:
+                futures = {
+                    executor.submit(_patch_target_, config_mod_path, config, composed_patches_by_version[current_version], patch_version, hash_cache, jobs): config_mod_path
+                    for config_mod_path, current_version
+                    in current_versions.items()
+                }
 
-    for idx in range(min_version, max_version+1):
-        print(f'> Patching with version {idx}...')
-        patchfile = patchfiles[idx]
+                for future in as_completed(futures):
+                    if (e := future.exception()) is not None:
+                        failed[futures[future]] = e
+    finally:
+        hash_cache.save()
 
-        for rel_config_path, patch in patchfile.items():
-            config_path = path_join(config_mod_path, rel_config_path)
-            patch.apply(config_path)
-        print(f'> Patching version {idx} complete.')
+    if len(failed) > 0:
+        for config_mod_path, e in sorted(failed.items()):
+            print(f'[!] Error for {config.target_name(config_mod_path)}: {e}')
+        raise RuntimeError(f'Patching failed for {len(failed)} of {len(config_mod_paths)} config mods.')
 
     print('Patching complete')
-    config.set_version(max_version)
-    config.save()
\ No newline at end of file
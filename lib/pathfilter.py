@@ -0,0 +1,33 @@
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from lib.policy import normalize_rel_path
+
+
+@dataclass
+class PathFilter():
+    # Selects config files by their path relative to the config mod, e.g. "Mods/Automate/*".
+    # A path matches if it matches any of the only globs (or there are none) and none of the exclude globs.
+    only: list[str]
+    exclude: list[str]
+
+    def __init__(self, only: list[str] | None = None, exclude: list[str] | None = None) -> None:
+        self.only = [normalize_rel_path(glob) for glob in only] if only is not None else []
+        self.exclude = [normalize_rel_path(glob) for glob in exclude] if exclude is not None else []
+
+    def matches(self, rel_path: str) -> bool:
+        rel_path = normalize_rel_path(rel_path)
+
+        if len(self.only) > 0 and not any(fnmatchcase(rel_path, glob) for glob in self.only):
+            return False
+
+        return not any(fnmatchcase(rel_path, glob) for glob in self.exclude)
+
+    def matches_any(self, rel_paths: list[str]) -> bool:
+        return any(self.matches(rel_path) for rel_path in rel_paths)
+
+    def describe(self) -> str:
+        parts = [f'only {", ".join(self.only)}'] if len(self.only) > 0 else []
+        if len(self.exclude) > 0:
+            parts.append(f'excluding {", ".join(self.exclude)}')
+        return ' '.join(parts)
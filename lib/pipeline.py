@@ -0,0 +1,153 @@
+from os.path import join as path_join
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Any, Tuple
+
+from lib.hashcache import HashCache
+from lib.patch import ComposedPatch, is_patched, patch_config, read_config, write_config
+from lib.profiling import Profiler, profiler
+from lib.transaction import ApplyTransaction
+
+# Number of config files per worker that can wait between two stages.
+# Only the config files in the queues and in the workers are held in memory, no matter how many are patched.
+QUEUE_DEPTH_PER_WORKER = 2
+_POLL_INTERVAL = 0.1
+_DONE = None
+
+
+class ApplyPipeline():
+    # Patches the config files of a config mod in three stages connected by bounded queues:
+    # - reader threads read the next config files and skip the ones that are already patched
+    # - the calling thread parses, patches and serializes them
+    # - writer threads write the patched config files
+    # The GIL still runs only one of them at a time, but reading and writing overlap with patching,
+    # which keeps both the CPU and slow disks busy.
+    config_mod_path: str
+    hash_cache: HashCache
+    transaction: ApplyTransaction | None
+    written: dict[str, bool]
+    errors: dict[str, Exception]
+    _tasks: Queue
+    _read: Queue
+    _patched: Queue
+    _readers: list[Thread]
+    _writers: list[Thread]
+    _stop: Event
+    _lock: Lock
+
+    def __init__(self, config_mod_path: str, hash_cache: HashCache, transaction: ApplyTransaction | None, jobs: int) -> None:
+        self.config_mod_path = config_mod_path
+        self.hash_cache = hash_cache
+        self.transaction = transaction
+        self.written = {}
+        self.errors = {}
+        self._tasks = Queue()
+        self._read = Queue(maxsize=jobs * QUEUE_DEPTH_PER_WORKER)
+        self._patched = Queue(maxsize=jobs * QUEUE_DEPTH_PER_WORKER)
+        self._readers = [Thread(target=self._read_worker_, daemon=True) for _ in range(jobs)]
+        self._writers = [Thread(target=self._write_worker_, daemon=True) for _ in range(jobs)]
+        self._stop = Event()
+        self._lock = Lock()
+
+    def _put_(self, queue: Queue, item: Any) -> bool:
+        # Blocks while the queue is full, unless the pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _done_(self, rel_config_path: str, written: bool | None = None, error: Exception | None = None) -> None:
+        with self._lock:
+            if error is not None:
+                self.errors[rel_config_path] = error
+            else:
+                self.written[rel_config_path] = bool(written)
+
+    def _read_worker_(self) -> None:
+        try:
+            while not self._stop.is_set():
+                try:
+                    rel_config_path, composed_patch = self._tasks.get_nowait()
+                except Empty:
+                    break
+
+                config_path = path_join(self.config_mod_path, rel_config_path)
+                try:
+                    with profiler.section(rel_config_path, Profiler.FILE):
+                        content, old_hash = read_config(config_path, self.hash_cache)
+                        if is_patched(composed_patch, config_path, old_hash, self.hash_cache):
+                            self._done_(rel_config_path, written=False)
+                            continue
+                except Exception as e:
+                    self._done_(rel_config_path, error=e)
+                    continue
+
+                if not self._put_(self._read, (rel_config_path, composed_patch, content, old_hash)):
+                    break
+        finally:
+            self._put_(self._read, _DONE)
+
+    def _write_worker_(self) -> None:
+        while (item := self._patched.get()) is not _DONE:
+            rel_config_path, new_content, new_hash = item
+
+            try:
+                with profiler.section(rel_config_path, Profiler.FILE):
+                    write_config(path_join(self.config_mod_path, rel_config_path), new_content, new_hash, self.hash_cache, self.transaction)
+            except Exception as e:
+                self._done_(rel_config_path, error=e)
+                continue
+
+            self._done_(rel_config_path, written=True)
+
+    def _patch_stage_(self) -> None:
+        running_readers = len(self._readers)
+
+        while running_readers > 0:
+            item = self._read.get()
+            if item is _DONE:
+                running_readers -= 1
+                continue
+
+            rel_config_path, composed_patch, content, old_hash = item
+            try:
+                with profiler.section(rel_config_path, Profiler.FILE):
+                    new_content, new_hash = patch_config(composed_patch, content)
+            except Exception as e:
+                self._done_(rel_config_path, error=e)
+                continue
+
+            # Unchanged files are not written, so their mtime stays the same
+            if old_hash == new_hash:
+                self._done_(rel_config_path, written=False)
+                continue
+
+            self._put_(self._patched, (rel_config_path, new_content, new_hash))
+
+    def run(self, composed_patches: dict[str, ComposedPatch]) -> Tuple[dict[str, bool], dict[str, Exception]]:
+        for item in composed_patches.items():
+            self._tasks.put(item)
+
+        for thread in self._readers + self._writers:
+            thread.start()
+
+        try:
+            self._patch_stage_()
+        except BaseException:
+            # e.g. Ctrl-C, the readers stop at the next config file and the queued files are still written,
+            # so the transaction can remove all written temp files afterwards
+            self._stop.set()
+            raise
+        finally:
+            for _ in self._writers:
+                self._patched.put(_DONE)
+            for thread in self._readers + self._writers:
+                thread.join()
+
+        return self.written, self.errors
+
+def apply_pipelined(config_mod_path: str, composed_patches: dict[str, ComposedPatch], hash_cache: HashCache, transaction: ApplyTransaction | None, jobs: int) -> Tuple[dict[str, bool], dict[str, Exception]]:
+    return ApplyPipeline(config_mod_path, hash_cache, transaction, jobs).run(composed_patches)
@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from lib.jsonc import read_jsonc
+from lib.diff import Difference, Direction
+
+
+def normalize_rel_path(rel_path: str) -> str:
+    # Patch files created on Windows contain backslashes, globs are always written with forward slashes
+    return rel_path.replace('\\', '/')
+
+@dataclass
+class PolicyRule():
+    mod: str
+    key: str
+    direction: Direction
+
+    def matches(self, rel_path: str, key: str) -> bool:
+        return fnmatchcase(rel_path, self.mod) and fnmatchcase(key, self.key)
+
+@dataclass
+class Policy():
+    # Resolves differences of the compare step without user input.
+    # The first rule whose mod glob matches the relative config path and whose key glob matches the dotted key wins.
+    #
+    # {
+    #     "rules": [
+    #         {"mod": "Mods/Automate/*", "key": "*", "direction": "CONFIG"},
+    #         {"mod": "*", "key": "Controls.*", "direction": "IGNORE"}
+    #     ]
+    # }
+    rules: list[PolicyRule]
+
+    @dataclass
+    class Keys():
+        RULES = "rules"
+        MOD = "mod"
+        KEY = "key"
+        DIRECTION = "direction"
+
+    @classmethod
+    def from_file(cls, filepath: str) -> 'Policy':
+        data = read_jsonc(filepath=filepath)
+
+        assert isinstance(data, dict)
+        rules = data[cls.Keys.RULES]
+        assert isinstance(rules, list)
+
+        return cls(rules=[
+            PolicyRule(
+                mod=rule.get(cls.Keys.MOD, '*'),
+                key=rule.get(cls.Keys.KEY, '*'),
+                direction=Direction.from_name(rule[cls.Keys.DIRECTION]),
+            )
+            for rule
+            in rules
+        ])
+
+    def direction(self, rel_path: str, diff: Difference) -> Direction | None:
+        rel_path = normalize_rel_path(rel_path)
+
+        for rule in self.rules:
+            if rule.matches(rel_path, diff.key):
+                return rule.direction
+
+        return None
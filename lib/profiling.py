@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from json import dump as json_dump
+from threading import Lock
+from time import perf_counter
+from typing import Any, Iterator
+
+
+@dataclass
+class Timing():
+    seconds: float = 0.0
+    calls: int = 0
+
+    def __json__(self) -> dict[str, Any]:
+        return {'seconds': self.seconds, 'calls': self.calls}
+
+class Profiler():
+    # Times named sections of a run, grouped into categories.
+    # Sections with the same category and name are summed up, e.g. loading and composing the same version.
+    PHASE = 'phase'
+    VERSION = 'version'
+    FILE = 'file'
+
+    enabled: bool
+    _timings: dict[str, dict[str, Timing]]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._timings = {}
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    @contextmanager
+    def section(self, name: str, category: str = PHASE) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+
+            with self._lock:
+                timing = self._timings.setdefault(category, {}).setdefault(name, Timing())
+                timing.seconds += seconds
+                timing.calls += 1
+
+    def slowest(self, category: str, count: int) -> list[tuple[str, Timing]]:
+        timings = self._timings.get(category, {})
+        return sorted(timings.items(), key=lambda item: item[1].seconds, reverse=True)[:count]
+
+    def print_report(self, count: int = 10) -> None:
+        print('Profile:')
+        for name, timing in self._timings.get(self.PHASE, {}).items():
+            print(f'  {name}: {timing.seconds:.3f} s')
+
+        for category, title in ((self.VERSION, 'versions'), (self.FILE, 'config files')):
+            slowest = self.slowest(category, count)
+            if len(slowest) > 0:
+                print(f'  Slowest {title}:')
+                for name, timing in slowest:
+                    print(f'    {name}: {timing.seconds:.3f} s')
+
+    def save_report(self, filepath: str) -> None:
+        report = {
+            category: {name: timing.__json__() for name, timing in timings.items()}
+            for category, timings
+            in self._timings.items()
+        }
+
+        with open(filepath, 'w') as f:
+            json_dump(report, f, indent=2)
+
+profiler = Profiler()
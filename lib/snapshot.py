@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from json import dump as json_dump
+from json import load as json_load
+from os.path import isfile
+from typing import Any
+
+from lib.config import PatcherConfig
+from lib.patch import PatchIndex, compose_patches, load_patches
+
+
+@dataclass
+class PatchedStateCache():
+    # The patched state of every config file after applying all patch versions up to and including version to {}.
+    # It is only valid as long as the patch files of these versions did not change, which is checked with their hashes.
+    FILENAME = 'config_patcher.snapshot.json'
+    config: PatcherConfig
+    version: int
+    hashes: dict[int, str]
+    states: dict[str, dict]
+
+    @dataclass
+    class Keys():
+        VERSION = "version"
+        HASHES = "hashes"
+        STATES = "states"
+
+    @classmethod
+    def filepath(cls, config: PatcherConfig) -> str:
+        return config.data_filepath(cls.FILENAME)
+
+    @classmethod
+    def empty(cls, config: PatcherConfig) -> 'PatchedStateCache':
+        return cls(config=config, version=-1, hashes={}, states={})
+
+    @classmethod
+    def load(cls, config: PatcherConfig) -> 'PatchedStateCache':
+        filepath = cls.filepath(config)
+        if not isfile(filepath):
+            return cls.empty(config)
+
+        try:
+            with open(filepath, 'r') as f:
+                data: dict[str, Any] = json_load(f)
+
+            return cls(
+                config=config,
+                version=data[cls.Keys.VERSION],
+                hashes={int(k): v for k, v in data[cls.Keys.HASHES].items()},
+                states=data[cls.Keys.STATES],
+            )
+        except Exception as e:
+            print(f"[!] Ignoring invalid patched state cache {filepath}: {e}")
+            return cls.empty(config)
+
+    def save(self) -> None:
+        data = {
+            self.Keys.VERSION: self.version,
+            self.Keys.HASHES: self.hashes,
+            self.Keys.STATES: self.states,
+        }
+
+        with open(self.filepath(self.config), 'w') as f:
+            json_dump(data, f, indent=None, separators=(',', ':'))
+
+    def _is_valid_(self, index: PatchIndex) -> bool:
+        index_hashes = {entry.version: entry.hash for entry in index.values()}
+
+        return all(
+            index_hashes.get(version) == self.hashes.get(version)
+            for version
+            in range(self.version + 1)
+        )
+
+    def update(self, index: PatchIndex) -> None:
+        # Replays only the versions added since the cache was saved, or the complete history if an old patch file changed.
+        if not self._is_valid_(index):
+            self.version, self.hashes, self.states = -1, {}, {}
+
+        pending = index.pending_versions(self.version)
+        if len(pending) < 1:
+            return
+
+        patchfiles = load_patches(self.config, versions=pending, index=index)
+
+        for rel_config_path, composed_patch in compose_patches(patchfiles, pending).items():
+            self.states[rel_config_path] = composed_patch._apply_(self.states.get(rel_config_path))
+
+        for entry in index.values():
+            if entry.version in pending:
+                self.hashes[entry.version] = entry.hash
+        self.version = pending[-1]
+
+        self.save()
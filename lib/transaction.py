@@ -0,0 +1,170 @@
+from dataclasses import dataclass
+from json import dump as json_dump
+from json import load as json_load
+from os import fsync, listdir, remove, replace, walk
+from os.path import dirname, isfile
+from os.path import join as path_join
+from threading import Lock
+from typing import Any
+
+try:
+    from os import sync as _sync_all
+except ImportError: # not available on Windows
+    _sync_all = None
+
+from lib.config import PatcherConfig
+from lib.hashcache import HashCache
+
+
+def _sync_(filepaths: list[str]) -> None:
+    # Flushes all written files to disk at once. Windows has no sync, so every file is flushed on its own there.
+    if len(filepaths) < 1:
+        return
+
+    if _sync_all is not None:
+        _sync_all()
+        return
+
+    for filepath in filepaths:
+        if isfile(filepath):
+            with open(filepath, 'rb+') as f:
+                fsync(f.fileno())
+
+@dataclass
+class ApplyTransaction():
+    # Applies the patches to all config files of a config mod, or to none of them.
+    # Every new config is written to a temp file next to the config file first. Once all of them are written,
+    # the planned renames are recorded in the journal, and the temp files replace the config files with os.replace.
+    # Only after this, the patch version is saved and the journal is removed.
+    #
+    # If the script is interrupted, the journal is found on the next start:
+    # - STAGING: not every temp file was written, so they are removed and the config files are untouched (roll back)
+    # - PREPARED: all temp files were written, so the remaining renames are done and the patch version is saved (roll forward)
+    # The patch version is None if only some config files were patched, which does not change the tracked version.
+    # One journal per config mod, as several config mods can be patched at the same time
+    FILENAME_PREFIX = 'config_patcher.journal.'
+    FILENAME_SUFFIX = '.json'
+    TEMP_SUFFIX = '.config_patcher.tmp'
+    STAGING = 'staging'
+    PREPARED = 'prepared'
+
+    config: PatcherConfig
+    config_mod_path: str
+    patch_version: int | None
+    status: str
+    # config file path -> content hash of the staged config
+    staged: dict[str, str]
+    _lock: Lock
+
+    @dataclass
+    class Keys():
+        CONFIG_MOD_PATH = "config_mod_path"
+        PATCH_VERSION = "patch_version"
+        STATUS = "status"
+        STAGED = "staged"
+
+    def __init__(self, config: PatcherConfig, config_mod_path: str, patch_version: int | None, status: str = STAGING, staged: dict[str, str] | None = None) -> None:
+        self.config = config
+        self.config_mod_path = config_mod_path
+        self.patch_version = patch_version
+        self.status = status
+        self.staged = staged if staged is not None else {}
+        self._lock = Lock()
+
+    def filepath(self) -> str:
+        return self.config.data_filepath(f'{self.FILENAME_PREFIX}{self.config.target_name(self.config_mod_path)}{self.FILENAME_SUFFIX}')
+
+    @classmethod
+    def temp_filepath(cls, config_path: str) -> str:
+        return config_path + cls.TEMP_SUFFIX
+
+    @classmethod
+    def begin(cls, config: PatcherConfig, config_mod_path: str, patch_version: int | None) -> 'ApplyTransaction':
+        transaction = cls(config, config_mod_path, patch_version)
+        transaction._save_journal_()
+        return transaction
+
+    @classmethod
+    def recover(cls, config: PatcherConfig) -> None:
+        data_folder = dirname(config.data_filepath(cls.FILENAME_PREFIX))
+
+        for filename in listdir(data_folder):
+            if filename.startswith(cls.FILENAME_PREFIX) and filename.endswith(cls.FILENAME_SUFFIX):
+                cls._recover_(config, path_join(data_folder, filename))
+
+    @classmethod
+    def _recover_(cls, config: PatcherConfig, filepath: str) -> None:
+        with open(filepath, 'r') as f:
+            data: dict[str, Any] = json_load(f)
+
+        transaction = cls(
+            config=config,
+            config_mod_path=data[cls.Keys.CONFIG_MOD_PATH],
+            patch_version=data[cls.Keys.PATCH_VERSION],
+            status=data[cls.Keys.STATUS],
+            staged=data[cls.Keys.STAGED],
+        )
+
+        if transaction.status == cls.PREPARED:
+            print(f'[!] Completing the interrupted patching of {transaction.config_mod_path}...')
+            transaction._roll_forward_()
+        else:
+            print(f'[!] Reverting the interrupted patching of {transaction.config_mod_path}...')
+            transaction.rollback()
+
+    def _save_journal_(self) -> None:
+        data = {
+            self.Keys.CONFIG_MOD_PATH: self.config_mod_path,
+            self.Keys.PATCH_VERSION: self.patch_version,
+            self.Keys.STATUS: self.status,
+            self.Keys.STAGED: self.staged,
+        }
+
+        filepath = self.filepath()
+        temp_filepath = filepath + self.TEMP_SUFFIX
+        with open(temp_filepath, 'w') as f:
+            json_dump(data, f, indent=None)
+            f.flush()
+            fsync(f.fileno())
+        replace(temp_filepath, filepath)
+
+    def stage(self, config_path: str, content: bytes, hash: str) -> None:
+        with open(self.temp_filepath(config_path), 'wb') as f:
+            f.write(content)
+
+        with self._lock:
+            self.staged[config_path] = hash
+
+    def rollback(self) -> None:
+        # Temp files of a STAGING journal are not recorded yet, so the config mod is searched for all of them
+        for root, _, files in walk(self.config_mod_path):
+            for file in files:
+                if file.endswith(self.TEMP_SUFFIX):
+                    remove(path_join(root, file))
+
+        if isfile(self.filepath()):
+            remove(self.filepath())
+
+    def commit(self, hash_cache: HashCache | None = None) -> None:
+        _sync_([self.temp_filepath(config_path) for config_path in self.staged])
+        self.status = self.PREPARED
+        self._save_journal_()
+
+        self._roll_forward_(hash_cache)
+
+    def _roll_forward_(self, hash_cache: HashCache | None = None) -> None:
+        for config_path in self.staged:
+            temp_filepath = self.temp_filepath(config_path)
+            # Already renamed if the previous roll forward was interrupted
+            if isfile(temp_filepath):
+                replace(temp_filepath, config_path)
+        _sync_(list(self.staged))
+
+        if hash_cache is not None:
+            for config_path, hash in self.staged.items():
+                hash_cache.set_hash(config_path, hash)
+
+        if self.patch_version is not None:
+            self.config.set_target_version(self.config_mod_path, self.patch_version)
+            self.config.save()
+        remove(self.filepath())
@@ -1,17 +1,19 @@
+from functools import cached_property
 from json import load as json_load
 from os import makedirs
 from os.path import basename, isdir, isfile
 from os.path import join as path_join
 from re import compile as regex_compile
 from re import error as RegexError
-from typing import Any, Tuple
+from typing import Tuple
 
 from consolemenu import ConsoleMenu
-from consolemenu.items import SelectionItem
+from consolemenu.items import FunctionItem, SelectionItem
+from consolemenu.prompt_utils import PromptUtils
 
 from lib.config import PatcherConfig
-from lib.ui.items import (Direction, DirectionSelectionItem, InputItem,
-                          ValidatorItem)
+from lib.diff import Difference, Direction, Path, differences, resolve
+from lib.ui.items import DirectionSelectionItem, InputItem, ValidatorItem
 from Typing import SCRIPT_ROOT
 
 
@@ -111,6 +113,18 @@ class _PatcherConfigCreationMenu(ConsoleMenu):
         )
 
 class _CompareMenu(ConsoleMenu):
+    # Only the rows of the current page are menu items, so drawing the menu does not depend on the number of differences.
+    # The selected directions are kept in a dict by path and survive changing the page or the filter.
+    PAGE_SIZE = 20
+    _BULK_DIRECTIONS = {d.name[0].lower(): d for d in Direction}
+
+    _diffs: list[Difference]
+    _filtered_diffs: list[Difference]
+    _directions: dict[Path, Direction]
+    _key_filter: str
+    _page: int
+    _error: str | None
+
     def __init__(self) -> None:
         super().__init__(
             title='',
@@ -118,102 +132,85 @@ class _CompareMenu(ConsoleMenu):
             exit_option_text='Confirm',
             exit_menu_char='c',
         )
+        self.prompt_utils = PromptUtils(self.screen)
 
-    def _flatten_dict_(self, d: dict, parent_key='', sep='.') -> dict:
-        items: list[Tuple[str, Any]] = []
-
-        for k, v in d.items():
-            new_key = f'{parent_key}{sep}{k}' if parent_key else k
+    def _page_count_(self) -> int:
+        return max(1, -(-len(self._filtered_diffs) // self.PAGE_SIZE))
 
-            if isinstance(v, dict):
-                items.extend(self._flatten_dict_(d=v, parent_key=new_key, sep=sep).items())
-            else:
-                items.append((new_key, v))
-        
-        return dict(items)
-    
-    def _unflatten_dict_(self, d: dict, sep='.') -> dict:
-        result_dict = {}
+    def _update_items_(self) -> None:
+        self.items.clear()
 
-        for k, v in d.items():
-            keys = k.split(sep)
-            d_temp: dict = result_dict
+        start = self._page * self.PAGE_SIZE
+        for diff in self._filtered_diffs[start:start + self.PAGE_SIZE]:
+            self.append_item(DirectionSelectionItem(
+                diff=diff,
+                directions=self._directions,
+                default_value=Direction.CONFIG,
+                menu=self
+            ))
 
-            for key in keys[:-1]:
-                d_temp = d_temp.setdefault(key, {})
+        self.append_item(FunctionItem('Next page', self._change_page_, args=[1], menu=self, menu_char='n'))
+        self.append_item(FunctionItem('Previous page', self._change_page_, args=[-1], menu=self, menu_char='p'))
+        self.append_item(FunctionItem('Filter by key prefix', self._filter_, menu=self, menu_char='f'))
+        self.append_item(FunctionItem('Set all filtered differences', self._set_all_, menu=self, menu_char='a'))
+        self.add_exit()
 
-            d_temp[keys[-1]] = v
+        key_filter = f' starting with "{self._key_filter}"' if self._key_filter else ''
+        self.prologue_text = f'{len(self._filtered_diffs)} of {len(self._diffs)} differences{key_filter}, page {self._page + 1}/{self._page_count_()}'
+        if self._error is not None:
+            self.prologue_text += f'\n{self._error}'
+            self._error = None
 
-        return result_dict
-    
-    def show(self, filename: str, on_disk: dict, patch: dict) -> Tuple[dict, dict, dict]:
-        self.subtitle = filename
+        self.current_option = min(self.current_option, len(self.items) - 1)
 
-        on_disk_flattend = self._flatten_dict_(on_disk)
-        patch_flattend = self._flatten_dict_(patch)
-        
-        CREATE_D_IDENT, OVERWRITE_D_IDENT, REMOVE_D_IDENT = 0,1,2
-        create_d, overwrite_d, remove_d = dict(), dict(), dict()
-        key_map: dict[str, Tuple[int, dict]] = {}
+    def _change_page_(self, offset: int) -> None:
+        self._page = min(max(self._page + offset, 0), self._page_count_() - 1)
 
-        for k, on_disk_value in on_disk_flattend.items():
-            if k in patch_flattend:
-                patch_value = patch_flattend[k]
+    def _filter_(self) -> None:
+        self._key_filter = self.prompt_utils.input('Enter the key prefix to filter by (empty to show all): ').input_string.strip()
+        self._filtered_diffs = [diff for diff in self._diffs if diff.key.startswith(self._key_filter)]
+        self._page = 0
 
-                if on_disk_value != patch_value:
-                    key_map[k] = (OVERWRITE_D_IDENT, overwrite_d)
-            else:
-                key_map[k] = (CREATE_D_IDENT, create_d)
+    def _set_all_(self) -> None:
+        choice = self.prompt_utils.input(f'Set all {len(self._filtered_diffs)} filtered differences to (c)onfig, (i)gnore or (p)atch: ').input_string.strip().lower()
 
-        for k in patch_flattend.keys():
-            if k not in on_disk_flattend:
-                key_map[k] = (REMOVE_D_IDENT, remove_d)
+        direction = self._BULK_DIRECTIONS.get(choice[:1]) if len(choice) > 0 else None
+        if direction is None:
+            self._error = f'Invalid direction: "{choice}"'
+            return
 
-        self.items.clear()
+        for diff in self._filtered_diffs:
+            self._directions[diff.path] = direction
 
-        if len(key_map) < 1:
-            return {}, {}, {}
+    def select(self) -> None:
+        super().select()
+        # Items are only replaced after the selected item has finished, as ConsoleMenu.select still uses it
+        if not self.should_exit:
+            self._update_items_()
 
-        for k, d in key_map.items():
-            id_, d = d
-            on_disk_value = 'REMOVE' if id_ == REMOVE_D_IDENT else str(on_disk_flattend[k])
-            patch_value = 'IGNORE' if id_ == CREATE_D_IDENT else str(patch_flattend[k])
+    def show(self, filename: str, on_disk: dict, patch: dict) -> Tuple[dict, dict, dict]:
+        self.subtitle = filename
 
-            self.append_item(DirectionSelectionItem(
-                key=k,
-                on_disk_value=on_disk_value,
-                default_value=Direction.CONFIG,
-                patch_value=patch_value,
-                menu=self
-            ))
-            
-        super().show(True)
+        self._diffs = differences(on_disk=on_disk, patch=patch)
 
-        for item in self.items:
-            if not isinstance(item, DirectionSelectionItem):
-                continue
+        if len(self._diffs) < 1:
+            return {}, {}, {}
 
-            k = item.get_key()
+        self._filtered_diffs = self._diffs
+        self._directions = {}
+        self._key_filter = ''
+        self._page = 0
+        self._error = None
+        self.current_option = 0
+        self._update_items_()
 
-            id_, d = key_map[k]
+        super().show(True)
 
-            match item.get_return():
-                case Direction.CONFIG:
-                    if id_ == REMOVE_D_IDENT:
-                        d[k] = {}
-                    else:
-                        d[k] = on_disk_flattend[k]
-                case Direction.PATCH:
-                    if id_ != CREATE_D_IDENT:
-                        d[k] = patch_flattend[k]
-                case Direction.IGNORE:
-                    continue
-        
-        create_d_nested = self._unflatten_dict_(create_d)
-        overwrite_d_nested = self._unflatten_dict_(overwrite_d)
-        remove_d_nested = self._unflatten_dict_(remove_d)
-
-        return create_d_nested, overwrite_d_nested, remove_d_nested
+        return resolve(
+            (diff, self._directions.get(diff.path, Direction.CONFIG))
+            for diff
+            in self._diffs
+        )
 
 class FolderSelectionMenu(ConsoleMenu):
     def __init__(self):
@@ -247,14 +244,18 @@ class FolderSelectionMenu(ConsoleMenu):
             return temp_folder
 
 class ConsoleUserInterface():
-    _patcherConfig_creation_menu: _PatcherConfigCreationMenu
-    _compare_menu: _CompareMenu
-    _output_folder_selection_menu: FolderSelectionMenu
-
-    def __init__(self) -> None:
-        self._patcherConfig_creation_menu = _PatcherConfigCreationMenu()
-        self._compare_menu = _CompareMenu()
-        self._output_folder_selection_menu = FolderSelectionMenu()
+    # Every menu is only created once it is shown for the first time
+    @cached_property
+    def _patcherConfig_creation_menu(self) -> _PatcherConfigCreationMenu:
+        return _PatcherConfigCreationMenu()
+
+    @cached_property
+    def _compare_menu(self) -> _CompareMenu:
+        return _CompareMenu()
+
+    @cached_property
+    def _output_folder_selection_menu(self) -> FolderSelectionMenu:
+        return FolderSelectionMenu()
 
     def create_PatcherConfig(self) -> PatcherConfig:
         return self._patcherConfig_creation_menu.show()
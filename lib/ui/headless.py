@@ -0,0 +1,42 @@
+from json import dump as json_dump
+from typing import Tuple
+
+from lib.diff import Direction, differences, resolve
+from lib.policy import Policy
+
+
+class HeadlessUserInterface():
+    # Resolves the differences of the compare step with a Policy instead of the compare menu.
+    # Differences no rule matches are ignored and collected in the unresolved report.
+    policy: Policy
+    unresolved: dict[str, list[str]]
+
+    def __init__(self, policy: Policy) -> None:
+        self.policy = policy
+        self.unresolved = {}
+
+    def compare(self, filename: str, on_disk: dict, patch: dict) -> Tuple[dict, dict, dict]:
+        resolved_differences = []
+
+        for diff in differences(on_disk=on_disk, patch=patch):
+            direction = self.policy.direction(filename, diff)
+
+            if direction is None:
+                self.unresolved.setdefault(filename, []).append(diff.key)
+                direction = Direction.IGNORE
+
+            resolved_differences.append((diff, direction))
+
+        return resolve(resolved_differences)
+
+    def print_report(self) -> None:
+        if len(self.unresolved) < 1:
+            return
+
+        print(f'[!] {sum(len(keys) for keys in self.unresolved.values())} differences in {len(self.unresolved)} config files were not matched by the policy and ignored:')
+        for filename, keys in self.unresolved.items():
+            print(f'  {filename}: {", ".join(keys)}')
+
+    def save_report(self, filepath: str) -> None:
+        with open(filepath, 'w') as f:
+            json_dump(self.unresolved, f, indent=2)
@@ -1,9 +1,10 @@
-from enum import Enum
 from typing import Optional, Callable
 from consolemenu import ConsoleMenu
 from consolemenu.items import MenuItem
 from consolemenu.prompt_utils import PromptUtils
 
+from lib.diff import Difference, Direction, Path
+
 class InputItem(MenuItem):
     _value: str = ''
 
@@ -64,40 +65,33 @@ class OptionalOptionItem(MenuItem):
     def get_return(self) -> Optional[bool]:
         return self._value
 
-class Direction(Enum):
-    CONFIG = True
-    IGNORE = None
-    PATCH = False
-
-    @classmethod
-    def from_value(cls, value: Optional[bool]) -> 'Direction':
-        match value:
-            case cls.CONFIG.value:
-                return cls.CONFIG
-            case cls.IGNORE.value:
-                return cls.IGNORE
-            case cls.PATCH.value:
-                return cls.PATCH
-            case _:
-                raise ValueError
-
 class DirectionSelectionItem(OptionalOptionItem):
+    # The selected direction is stored in the directions dict shared by all pages of the compare menu,
+    # so the item can be dropped and recreated whenever the page changes.
     _TRUE_CHAR = 'Config'
     _NOT_SET_CHAR = 'Ignore'
     _FALSE_CHAR = 'Patch'
-    _key: str
+    _diff: Difference
+    _directions: dict[Path, Direction]
+    _default_value: Direction
+
+    def __init__(self, diff: Difference, directions: dict[Path, Direction], default_value: Direction = Direction.IGNORE, menu: ConsoleMenu | None = None, menu_char: str | None = None) -> None:
+        super().__init__(lambda: f'{diff.key}:\nConfig Value: {diff.on_disk_text()}\nPatch Value: {diff.patch_text()}', menu=menu, should_exit=False, menu_char=menu_char)
+        self._diff = diff
+        self._directions = directions
+        self._default_value = default_value
 
-    def __init__(self, key: str, on_disk_value: str, patch_value: str, default_value: Direction = Direction.IGNORE, menu: ConsoleMenu | None = None, menu_char: str | None = None) -> None:
-        super().__init__(f'{key}:\nConfig Value: {on_disk_value}\nPatch Value: {patch_value}', menu=menu, should_exit=False, menu_char=menu_char)
-        self._key = key
-        self._value = default_value.value
+    @property
+    def _value(self) -> Optional[bool]:
+        return self._directions.get(self._diff.path, self._default_value).value
+
+    @_value.setter
+    def _value(self, value: Optional[bool]) -> None:
+        self._directions[self._diff.path] = Direction.from_value(value)
 
     def get_return(self) -> Direction:
         return Direction.from_value(self._value)
-            
-    def get_key(self) -> str:
-        return self._key
-    
+
 class OptionItem(OptionalOptionItem):
     def __init__(self, text: str | Callable[[], str], menu: ConsoleMenu | None = None, should_exit: bool = False, menu_char: str | None = None) -> None:
         super().__init__(text, menu, should_exit, menu_char)
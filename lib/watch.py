@@ -0,0 +1,291 @@
+from os import sep, stat, walk
+from os.path import isdir
+from os.path import join as path_join
+from os.path import relpath
+from threading import Event, Lock, Thread
+from time import sleep
+from typing import TYPE_CHECKING
+
+try:
+    from inotify_simple import INotify
+    from inotify_simple import flags as inotify_flags
+except ImportError: # inotify_simple is optional and only available on Linux
+    INotify = None
+
+from lib.config import PatcherConfig
+from lib.diff import Difference, differences
+from lib.discovery import CONFIG_FILENAME, DiscoveryCache, scan_for_configs
+from lib.hashcache import HashCache
+from lib.jsonc import read_jsonc
+from lib.pathfilter import PathFilter
+from lib.patch import Patch, PatchFile, PatchIndex
+from lib.snapshot import PatchedStateCache
+from lib.ui.headless import HeadlessUserInterface
+
+if TYPE_CHECKING:
+    from lib.ui.console import ConsoleUserInterface
+
+
+class _PollingWatcher():
+    # Compares mtime and size of every config file on each poll. New config files are found with the discovery cache,
+    # which only lists directories that changed.
+    config_mod_path: str
+    interval: float
+    discovery_cache: DiscoveryCache
+    stats: dict[str, tuple[int, int]]
+
+    def __init__(self, config_mod_path: str, discovery_cache: DiscoveryCache, interval: float) -> None:
+        self.config_mod_path = config_mod_path
+        self.interval = interval
+        self.discovery_cache = discovery_cache
+        self.stats = {}
+        self._changes_()
+
+    def _changes_(self) -> set[str]:
+        stats: dict[str, tuple[int, int]] = {}
+
+        for config_path in scan_for_configs(self.config_mod_path, self.discovery_cache):
+            try:
+                st = stat(config_path)
+            except FileNotFoundError:
+                continue
+            stats[config_path] = (st.st_mtime_ns, st.st_size)
+
+        changed = {
+            config_path
+            for config_path
+            in stats.keys() | self.stats.keys()
+            if stats.get(config_path) != self.stats.get(config_path)
+        }
+        self.stats = stats
+
+        return changed
+
+    def poll(self) -> set[str]:
+        sleep(self.interval)
+        return self._changes_()
+
+    def close(self) -> None:
+        pass
+
+class _InotifyWatcher():
+    # inotify does not watch subdirectories, so every directory of the config mod gets its own watch.
+    # Returns the paths of changed config files, or of directories that were created, moved or deleted as a whole.
+    MASK = (
+        inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.MOVED_FROM
+        | inotify_flags.CREATE | inotify_flags.DELETE
+    ) if INotify is not None else 0
+
+    config_mod_path: str
+    interval: float
+    inotify: 'INotify'
+    folders: dict[int, str]
+
+    def __init__(self, config_mod_path: str, interval: float) -> None:
+        self.config_mod_path = config_mod_path
+        self.interval = interval
+        self.inotify = INotify()
+        self.folders = {}
+        self._add_watches_(config_mod_path)
+
+    def _add_watches_(self, folder: str) -> None:
+        for root, _, _ in walk(folder):
+            self.folders[self.inotify.add_watch(root, self.MASK)] = root
+
+    def poll(self) -> set[str]:
+        changed: set[str] = set()
+
+        for event in self.inotify.read(timeout=int(self.interval * 1000), read_delay=50):
+            if event.mask & inotify_flags.Q_OVERFLOW:
+                # Events were lost, so everything has to be checked again
+                changed.add(self.config_mod_path)
+                continue
+
+            folder = self.folders.get(event.wd)
+            if folder is None:
+                continue
+            path = path_join(folder, event.name)
+
+            if event.mask & inotify_flags.ISDIR:
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    self._add_watches_(path)
+                changed.add(path)
+            elif event.name == CONFIG_FILENAME:
+                changed.add(path)
+
+        return changed
+
+    def close(self) -> None:
+        self.inotify.close()
+
+class ConfigWatch():
+    # Keeps every config file of a config mod parsed in memory together with its differences to the patched state,
+    # so a patch file can be created from the pending changes without reading all config files again.
+    config: PatcherConfig
+    config_mod_path: str
+    patched_state_cache: PatchedStateCache
+    path_filter: PathFilter | None
+    configs: dict[str, dict]
+    pending: dict[str, list[Difference]]
+    _discovery_cache: DiscoveryCache
+    _watcher: _PollingWatcher | _InotifyWatcher
+    _lock: Lock
+    _stop: Event
+    _thread: Thread
+
+    def __init__(self, config_mod_path: str, config: PatcherConfig, interval: float = 1.0, path_filter: PathFilter | None = None) -> None:
+        self.config = config
+        self.config_mod_path = config_mod_path
+        self.path_filter = path_filter
+        self.patched_state_cache = PatchedStateCache.load(config)
+        self.patched_state_cache.update(PatchIndex.load(config))
+        self.configs = {}
+        self.pending = {}
+        self._discovery_cache = DiscoveryCache.load(config)
+        self._lock = Lock()
+        self._stop = Event()
+
+        if INotify is not None:
+            self._watcher = _InotifyWatcher(config_mod_path, interval)
+            self._refresh_(config_mod_path)
+        else:
+            self._watcher = _PollingWatcher(config_mod_path, self._discovery_cache, interval)
+            for config_path in self._watcher.stats:
+                self._refresh_config_(config_path)
+
+        self._thread = Thread(target=self._run_, daemon=True)
+
+    @property
+    def uses_inotify(self) -> bool:
+        return isinstance(self._watcher, _InotifyWatcher)
+
+    def _refresh_config_(self, config_path: str) -> None:
+        rel_config_path = relpath(config_path, self.config_mod_path)
+        if self.path_filter is not None and not self.path_filter.matches(rel_config_path):
+            return
+
+        try:
+            self.configs[rel_config_path] = read_jsonc(config_path)
+        except FileNotFoundError:
+            self.configs.pop(rel_config_path, None)
+        except ValueError as e:
+            # Probably still being written, the next change event reads it again
+            print(f"[!] Could not read {rel_config_path}: {e}")
+            return
+
+        self._update_pending_(rel_config_path)
+
+    def _refresh_(self, path: str) -> None:
+        if path.endswith(sep + CONFIG_FILENAME):
+            self._refresh_config_(path)
+            return
+
+        # A whole directory was created, moved or deleted
+        rel_folder = relpath(path, self.config_mod_path)
+        for rel_config_path in list(self.configs):
+            if rel_folder == '.' or rel_config_path.startswith(rel_folder + sep):
+                self._refresh_config_(path_join(self.config_mod_path, rel_config_path))
+
+        if isdir(path):
+            for config_path in scan_for_configs(path, self._discovery_cache):
+                self._refresh_config_(config_path)
+
+    def _update_pending_(self, rel_config_path: str) -> None:
+        on_disk_config = self.configs.get(rel_config_path)
+        diffs = differences(on_disk=on_disk_config, patch=self.patched_state_cache.states.get(rel_config_path, {})) if on_disk_config is not None else []
+
+        if len(diffs) > 0:
+            self.pending[rel_config_path] = diffs
+        else:
+            self.pending.pop(rel_config_path, None)
+
+    def _run_(self) -> None:
+        while not self._stop.is_set():
+            changed = self._watcher.poll()
+            if len(changed) < 1:
+                continue
+
+            with self._lock:
+                pending_before = len(self.pending)
+                for path in changed:
+                    self._refresh_(path)
+
+                if len(self.pending) != pending_before:
+                    print(f"\n[ ] {len(self.pending)} config files with pending changes")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._watcher.close()
+        self._discovery_cache.save()
+
+    def print_pending(self) -> None:
+        with self._lock:
+            if len(self.pending) < 1:
+                print("[ ] No pending changes.")
+                return
+
+            for rel_config_path, diffs in sorted(self.pending.items()):
+                print(f"  {rel_config_path}: {', '.join(diff.key for diff in diffs)}")
+
+    def create_patch_file(self, cui: 'ConsoleUserInterface | HeadlessUserInterface') -> None:
+        with self._lock:
+            patch_index = PatchIndex.load(self.config)
+            patch_versions = patch_index.versions()
+            patch_version = patch_versions[-1] + 1 if len(patch_versions) > 0 else 0
+
+            new_patches: dict[str, Patch] = {}
+            hash_cache = HashCache.load(self.config)
+
+            for rel_config_path in sorted(self.pending):
+                patch = Patch.from_compare(
+                    on_disk_config=self.configs[rel_config_path],
+                    patched_config=self.patched_state_cache.states.get(rel_config_path, {}),
+                    rel_path=rel_config_path,
+                    cui=cui,
+                    before=hash_cache.written_hash(path_join(self.config_mod_path, rel_config_path)),
+                )
+                if patch is not None:
+                    new_patches[rel_config_path] = patch
+
+            if len(new_patches) < 1:
+                print("[!] Nothing to patch.")
+                return
+
+            PatchFile.create_and_save(version=patch_version, patches=new_patches, config=self.config)
+            print(f"[ ] Created patch file version {patch_version}")
+
+            for rel_config_path in new_patches:
+                hash_cache.mark_written(path_join(self.config_mod_path, rel_config_path))
+            hash_cache.save()
+
+            # Only the config files of the new version changed their patched state
+            self.patched_state_cache.update(PatchIndex.load(self.config))
+            for rel_config_path in new_patches:
+                self._update_pending_(rel_config_path)
+
+def watch_config_mod(config_mod_path: str, config: PatcherConfig, cui: 'ConsoleUserInterface | HeadlessUserInterface', path_filter: PathFilter | None = None) -> None:
+    watch = ConfigWatch(config_mod_path, config, path_filter=path_filter)
+    watch.start()
+
+    print(f"[ ] Watching {config_mod_path} {'with inotify' if watch.uses_inotify else 'by polling'}, {len(watch.pending)} config files with pending changes")
+    print("Enter 'p' to create a patch file from the pending changes, 's' to show them and 'q' to stop watching.")
+
+    try:
+        while True:
+            match input('> ').strip().lower():
+                case 'q':
+                    break
+                case 'p':
+                    watch.create_patch_file(cui)
+                case 's':
+                    watch.print_pending()
+                case _:
+                    continue
+    except EOFError:
+        pass
+    finally:
+        watch.stop()
@@ -0,0 +1,30 @@
+from time import perf_counter
+from unittest import TestCase, main
+
+from lib.jsonc import loads_jsonc, strip_jsonc
+
+
+class StripJsoncTest(TestCase):
+    def test_comments_and_trailing_commas(self):
+        jsonc = '{\n  // comment\n  "url": "https://example.com//x", /* block, } */\n  "list": [1, 2, /* last */ ],\n  "quote": "\\"//\\\\",\n}'
+        self.assertEqual(loads_jsonc(jsonc), {'url': 'https://example.com//x', 'list': [1, 2], 'quote': '"//\\'})
+
+    def test_block_comment_spanning_own_line_comments(self):
+        jsonc = '{"a": 1, /* start\n  // inner */ "b": 2}'
+        self.assertEqual(loads_jsonc(jsonc), {'a': 1, 'b': 2})
+
+    def test_long_minified_line(self):
+        # Every marker used to recount the quotes back to the start of its line, which was quadratic on minified configs
+        count = 20000
+        jsonc = '/*c*/{' + ','.join(f'"k{i}": "https://example.com/{i}//x", "l{i}": [{i}, ]' for i in range(count)) + ',}'
+
+        start = perf_counter()
+        stripped = strip_jsonc(jsonc)
+        duration = perf_counter() - start
+
+        self.assertEqual(len(loads_jsonc(stripped)), 2 * count)
+        self.assertEqual(loads_jsonc(stripped)[f'k{count - 1}'], f'https://example.com/{count - 1}//x')
+        self.assertLess(duration, 2.0)
+
+if __name__ == '__main__':
+    main()